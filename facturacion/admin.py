@@ -1,7 +1,18 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
-from .models import Cliente, Factura, DetalleFactura
+from .models import Cliente, Factura, DetalleFactura, invalidar_estadisticas
+
+
+class ColumnasListadoChangeList(ChangeList):
+    """ChangeList que carga solo las columnas declaradas en list_only_fields"""
+    def get_queryset(self, request, *args, **kwargs):
+        queryset = super().get_queryset(request, *args, **kwargs)
+        return queryset.only(*self.model_admin.list_only_fields)
 
 
 class DetalleFacturaInline(admin.TabularInline):
@@ -19,6 +30,7 @@ class ClienteAdmin(admin.ModelAdmin):
     list_filter = ['activo', 'fecha_creacion']
     search_fields = ['nombre', 'ruc_ci', 'telefono', 'email']
     list_editable = ['activo']
+    list_only_fields = ['nombre', 'ruc_ci', 'telefono', 'email', 'activo', 'fecha_creacion']
     ordering = ['nombre']
     date_hierarchy = 'fecha_creacion'
     
@@ -40,18 +52,25 @@ class ClienteAdmin(admin.ModelAdmin):
     
     readonly_fields = ['fecha_creacion', 'fecha_actualizacion']
     
+    def get_changelist(self, request, **kwargs):
+        return ColumnasListadoChangeList
+    
+    def get_queryset(self, request):
+        """Anota el total de facturas activas en una sola consulta"""
+        return super().get_queryset(request).annotate(
+            _total_facturas=Count('facturas', filter=Q(facturas__activo=True))
+        )
+    
     def total_facturas_admin(self, obj):
         """Muestra el total de facturas del cliente"""
-        try:
-            total = obj.total_facturas()
-            return format_html(
-                "{} factura{}",
-                total,
-                's' if total != 1 else ''
-            )
-        except Exception:
-            return "Error"
+        total = obj._total_facturas
+        return format_html(
+            "{} factura{}",
+            total,
+            's' if total != 1 else ''
+        )
     total_facturas_admin.short_description = 'Total Facturas'
+    total_facturas_admin.admin_order_field = '_total_facturas'
 
 
 @admin.register(Factura)
@@ -66,6 +85,12 @@ class FacturaAdmin(admin.ModelAdmin):
     ordering = ['-fecha_emision', '-numero_factura']
     date_hierarchy = 'fecha_emision'
     list_per_page = 20
+    list_select_related = ['cliente']
+    autocomplete_fields = ['cliente']
+    list_only_fields = [
+        'numero_factura', 'cliente__nombre', 'cliente__ruc_ci', 'fecha_emision',
+        'subtotal', 'iva', 'total', 'estado', 'fecha_creacion'
+    ]
     inlines = [DetalleFacturaInline]
     
     fieldsets = (
@@ -86,6 +111,18 @@ class FacturaAdmin(admin.ModelAdmin):
     
     readonly_fields = ['fecha_creacion', 'fecha_actualizacion', 'subtotal', 'iva', 'total']
     
+    def get_changelist(self, request, **kwargs):
+        return ColumnasListadoChangeList
+    
+    def get_queryset(self, request):
+        """Incluye el cliente en la misma consulta (acciones, autocompletado)"""
+        return super().get_queryset(request).select_related('cliente')
+    
+    def save_related(self, request, form, formsets, change):
+        """Recalcula los totales una sola vez después de guardar los detalles"""
+        super().save_related(request, form, formsets, change)
+        form.instance.calcular_totales()
+    
     def estado_badge(self, obj):
         """Muestra el estado con colores"""
         colores = {
@@ -104,21 +141,32 @@ class FacturaAdmin(admin.ModelAdmin):
     
     actions = ['marcar_como_pagada', 'marcar_como_pendiente', 'anular_facturas']
     
+    def _cambiar_estado(self, queryset, estado):
+        """Bloquea las facturas libres y les asigna el estado; omite las que otro admin tiene bloqueadas"""
+        with transaction.atomic():
+            pks = list(queryset.select_for_update(skip_locked=True).values_list('pk', flat=True))
+            # fecha_actualizacion forma parte de la clave del PDF cacheado
+            actualizadas = Factura.objects.filter(pk__in=pks).update(
+                estado=estado, fecha_actualizacion=timezone.now()
+            )
+        invalidar_estadisticas()
+        return actualizadas
+    
     def marcar_como_pagada(self, request, queryset):
         """Marca facturas como pagadas"""
-        updated = queryset.filter(estado='PENDIENTE').update(estado='PAGADA')
+        updated = self._cambiar_estado(queryset.filter(estado='PENDIENTE'), 'PAGADA')
         self.message_user(request, f'{updated} factura(s) marcada(s) como pagada(s)')
     marcar_como_pagada.short_description = "Marcar como PAGADA"
     
     def marcar_como_pendiente(self, request, queryset):
         """Marca facturas como pendientes"""
-        updated = queryset.filter(estado='PAGADA').update(estado='PENDIENTE')
+        updated = self._cambiar_estado(queryset.filter(estado='PAGADA'), 'PENDIENTE')
         self.message_user(request, f'{updated} factura(s) marcada(s) como pendiente(s)')
     marcar_como_pendiente.short_description = "Marcar como PENDIENTE"
     
     def anular_facturas(self, request, queryset):
         """Anula facturas"""
-        updated = queryset.exclude(estado='ANULADA').update(estado='ANULADA')
+        updated = self._cambiar_estado(queryset.exclude(estado='ANULADA'), 'ANULADA')
         self.message_user(request, f'{updated} factura(s) anulada(s)')
     anular_facturas.short_description = "ANULAR facturas seleccionadas"
 
@@ -128,6 +176,8 @@ class DetalleFacturaAdmin(admin.ModelAdmin):
     """Configuración del administrador para Detalles de Factura"""
     list_display = ['factura', 'producto', 'cantidad', 'precio_unitario', 'subtotal']
     list_filter = ['factura__fecha_emision']
+    list_select_related = ['factura', 'factura__cliente']
+    autocomplete_fields = ['factura']
     search_fields = ['producto', 'factura__numero_factura']
     readonly_fields = ['subtotal']
     
@@ -139,6 +189,22 @@ class DetalleFacturaAdmin(admin.ModelAdmin):
             'fields': ('producto', 'cantidad', 'precio_unitario', 'subtotal')
         }),
     )
+    
+    def save_model(self, request, obj, form, change):
+        """Guarda el detalle y actualiza los totales de su factura"""
+        super().save_model(request, obj, form, change)
+        Factura.recalcular_bulk([obj])
+    
+    def delete_model(self, request, obj):
+        """Elimina el detalle y actualiza los totales de su factura"""
+        super().delete_model(request, obj)
+        Factura.recalcular_bulk([obj])
+    
+    def delete_queryset(self, request, queryset):
+        """Elimina los detalles y recalcula una vez cada factura afectada"""
+        detalles = list(queryset.only('pk', 'factura_id'))
+        super().delete_queryset(request, queryset)
+        Factura.recalcular_bulk(detalles)
 
 
 # Personalización del sitio de administración
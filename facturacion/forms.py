@@ -3,9 +3,11 @@ Formularios para el sistema de facturación
 """
 from django import forms
 from django.core.exceptions import ValidationError
-from .models import Cliente, Factura, DetalleFactura, TimbradoConfig, Producto
+from django.core import signing
+from .models import Cliente, Factura, DetalleFactura, TimbradoConfig, Producto, normalizar_ruc_ci, TIMBRADO_RE
 from decimal import Decimal
-from django.forms import inlineformset_factory
+from django.forms import inlineformset_factory, BaseInlineFormSet
+from django.utils.functional import cached_property
 import re
 import random
 from datetime import date, timedelta
@@ -13,6 +15,22 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+_RUC_CI_RE = re.compile(r'^\d{6,10}$')
+_THREE_DIGITS_RE = re.compile(r'^\d{3}$')
+
+_PHONE_STRIP = str.maketrans('', '', ' -()')
+_TIMBRADO_STRIP = str.maketrans('', '', ' -')
+
+_ZERO = Decimal('0')
+
+# Filas por INSERT al crear detalles (Django lo reduce si el motor admite menos parámetros)
+_DETALLES_BATCH_SIZE = 500
+
+# Estados que puede elegir cada tipo de usuario en FacturaForm
+_ESTADO_CHOICES_USUARIO = (('PENDIENTE', 'Pendiente'), ('PAGADA', 'Pagada'))
+_ESTADO_CHOICES_ADMIN = tuple(Factura.ESTADO_CHOICES)
+_ESTADO_FILTER_CHOICES = (('', 'Todos los estados'),) + _ESTADO_CHOICES_ADMIN
+
 
 class ProductoForm(forms.ModelForm):
     """Formulario para productos"""
@@ -77,11 +95,11 @@ class ClienteForm(forms.ModelForm):
         ruc_ci = self.cleaned_data.get('ruc_ci')
         if ruc_ci:
             try:
-                ruc_ci = ruc_ci.strip().replace(' ', '').replace('-', '')
-                if not re.match(r'^\d{6,10}$', ruc_ci):
+                ruc_ci = normalizar_ruc_ci(ruc_ci)
+                if not _RUC_CI_RE.match(ruc_ci):
                     raise forms.ValidationError("El RUC/CI debe contener entre 6 y 10 dígitos")
                 
-                existe = Cliente.objects.filter(ruc_ci__iexact=ruc_ci)
+                existe = Cliente.objects.filter(ruc_ci=ruc_ci)
                 if self.instance.pk:
                     existe = existe.exclude(pk=self.instance.pk)
                 if existe.exists():
@@ -89,7 +107,7 @@ class ClienteForm(forms.ModelForm):
             except forms.ValidationError:
                 raise
             except Exception as e:
-                logger.error(f'Error validando RUC/CI: {e}')
+                logger.error('Error validando RUC/CI: %s', e)
                 raise forms.ValidationError("Error en la validación del RUC/CI")
         return ruc_ci
 
@@ -97,7 +115,7 @@ class ClienteForm(forms.ModelForm):
         """Validación del teléfono"""
         telefono = self.cleaned_data.get('telefono')
         if telefono:
-            telefono = telefono.strip().replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
+            telefono = telefono.strip().translate(_PHONE_STRIP)
             if not telefono.isdigit():
                 raise forms.ValidationError("El teléfono debe contener solo números")
             if len(telefono) < 7:
@@ -144,27 +162,20 @@ class FacturaForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         
         try:
-            self.fields['cliente'].queryset = Cliente.objects.filter(activo=True).order_by('nombre')
+            campo_cliente = self.fields['cliente']
+            campo_cliente.queryset = Cliente.objects.filter(activo=True).order_by('nombre')
+            campo_cliente.choices = [('', campo_cliente.empty_label)] + Cliente.opciones_activas()
         except Exception as e:
-            logger.error(f'Error inicializando FacturaForm: {e}')
+            logger.error('Error inicializando FacturaForm: %s', e)
             self.fields['cliente'].queryset = Cliente.objects.none()
         
-        # Limitar opciones de estado según contexto
-        if self.es_creacion:
-            # Al crear: solo Pendiente y Pagada
-            self.fields['estado'].choices = [
-                ('PENDIENTE', 'Pendiente'),
-                ('PAGADA', 'Pagada'),
-            ]
+        # Limitar opciones de estado según contexto:
+        # al crear solo Pendiente y Pagada; al editar, Anulada solo para administradores
+        es_admin = self.user and (self.user.is_staff or self.user.is_superuser)
+        if not self.es_creacion and es_admin:
+            self.fields['estado'].choices = _ESTADO_CHOICES_ADMIN
         else:
-            # Al editar: incluir Anulada solo para administradores
-            if self.user and (self.user.is_staff or self.user.is_superuser):
-                self.fields['estado'].choices = Factura.ESTADO_CHOICES
-            else:
-                self.fields['estado'].choices = [
-                    ('PENDIENTE', 'Pendiente'),
-                    ('PAGADA', 'Pagada'),
-                ]
+            self.fields['estado'].choices = _ESTADO_CHOICES_USUARIO
     
     def clean_estado(self):
         estado = self.cleaned_data.get('estado')
@@ -181,14 +192,17 @@ class FacturaForm(forms.ModelForm):
         return estado
 
 
+def _producto_catalogo_choices():
+    return [('', 'Seleccionar producto del catálogo...')] + Producto.opciones_activas()
+
+
 class DetalleFacturaForm(forms.ModelForm):
     """
     Formulario para los detalles de la factura (productos/servicios)
     """
-    producto_catalogo = forms.ModelChoiceField(
-        queryset=Producto.objects.filter(activo=True),
+    producto_catalogo = forms.ChoiceField(
+        choices=_producto_catalogo_choices,
         required=False,
-        empty_label="Seleccionar producto del catálogo...",
         widget=forms.Select(attrs={
             'class': 'form-select producto-select',
             'onchange': 'cargarProducto(this)'
@@ -222,6 +236,24 @@ class DetalleFacturaForm(forms.ModelForm):
             'precio_unitario': 'Precio Unitario (₲)'
         }
 
+    def __init__(self, *args, **kwargs):
+        producto_choices = kwargs.pop('producto_choices', None)
+        super().__init__(*args, **kwargs)
+        if producto_choices is not None:
+            self.fields['producto_catalogo'].choices = producto_choices
+
+    def has_changed(self):
+        """
+        Una línea nueva sin descripción ni precio se considera vacía, aunque la
+        cantidad venga con el 1 por defecto, y el formset omite su validación
+        """
+        if self.instance.pk is None and self.is_bound:
+            return any(
+                (self.data.get(self.add_prefix(campo)) or '').strip()
+                for campo in ('producto', 'precio_unitario')
+            )
+        return super().has_changed()
+
     def clean(self):
         cleaned_data = super().clean()
         producto = cleaned_data.get('producto')
@@ -234,18 +266,53 @@ class DetalleFacturaForm(forms.ModelForm):
                 raise forms.ValidationError('Debe ingresar la descripción del producto')
             if not cantidad or cantidad < 1:
                 raise forms.ValidationError('La cantidad debe ser al menos 1')
-            if not precio or precio <= Decimal('0'):
+            if not precio or precio <= _ZERO:
                 raise forms.ValidationError('El precio debe ser mayor a 0')
         
         return cleaned_data
 
 
+class BaseDetalleFacturaFormSet(BaseInlineFormSet):
+    """
+    Formset de detalles que consulta el catálogo de productos una sola vez
+    y comparte las opciones entre todos sus formularios
+    """
+    @cached_property
+    def producto_choices(self):
+        return list(self.form.base_fields['producto_catalogo'].choices)
+
+    def get_form_kwargs(self, index):
+        kwargs = super().get_form_kwargs(index)
+        kwargs['producto_choices'] = self.producto_choices
+        return kwargs
+
+    def save(self, commit=True):
+        """
+        Inserta las líneas nuevas con un solo bulk_create. Debe llamarse dentro
+        de transaction.atomic() y seguido de factura.calcular_totales().
+        """
+        detalles = super().save(commit=False)
+        if not commit:
+            return detalles
+        
+        for detalle in self.deleted_objects:
+            detalle.delete()
+        
+        nuevos = [detalle for detalle in detalles if detalle.pk is None]
+        existentes = [detalle for detalle in detalles if detalle.pk is not None]
+        DetalleFactura.objects.bulk_create(nuevos, batch_size=_DETALLES_BATCH_SIZE)
+        for detalle in existentes:
+            detalle.save()
+        return detalles
+
+
 # Formset para manejar múltiples detalles en una factura
 DetalleFacturaFormSet = inlineformset_factory(
     Factura,
     DetalleFactura,
     form=DetalleFacturaForm,
-    extra=1,
+    formset=BaseDetalleFacturaFormSet,
+    extra=0,
     min_num=1,
     validate_min=True,
     can_delete=True,
@@ -268,14 +335,15 @@ class BusquedaFacturaForm(forms.Form):
 
     estado = forms.ChoiceField(
         required=False,
-        choices=[('', 'Todos los estados')] + Factura.ESTADO_CHOICES,
+        choices=_ESTADO_FILTER_CHOICES,
         widget=forms.Select(attrs={
             'class': 'form-select'
         })
     )
 
     cliente = forms.ModelChoiceField(
-        queryset=Cliente.objects.filter(activo=True),
+        # Solo las columnas que usa __str__; las opciones se renderizan desde la caché
+        queryset=Cliente.objects.filter(activo=True).only('pk', 'nombre', 'ruc_ci').order_by('nombre'),
         required=False,
         empty_label="Todos los clientes",
         widget=forms.Select(attrs={
@@ -317,6 +385,11 @@ class BusquedaFacturaForm(forms.Form):
         })
     )
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        campo_cliente = self.fields['cliente']
+        campo_cliente.choices = [('', campo_cliente.empty_label)] + Cliente.opciones_activas()
+
     def clean(self):
         cleaned_data = super().clean()
         fecha_desde = cleaned_data.get('fecha_desde')
@@ -368,8 +441,15 @@ class BusquedaClienteForm(forms.Form):
 class FacturaEliminarForm(forms.Form):
     """
     Formulario de confirmación con captcha matemático simple
-    para eliminar/anular facturas
+    para eliminar/anular facturas.
+
+    La operación viaja firmada en un campo oculto, por lo que no se
+    guarda estado en la sesión entre el GET y el POST.
     """
+    CAPTCHA_SALT = 'facturacion.captcha_anular'
+    CAPTCHA_MAX_AGE = 300
+
+    captcha_token = forms.CharField(widget=forms.HiddenInput)
     captcha_respuesta = forms.IntegerField(
         label="Respuesta",
         required=True,
@@ -382,15 +462,37 @@ class FacturaEliminarForm(forms.Form):
     )
     
     def __init__(self, *args, **kwargs):
-        self.captcha_a = random.randint(1, 10)
-        self.captcha_b = random.randint(1, 10)
-        self.captcha_respuesta_correcta = self.captcha_a + self.captcha_b
         super().__init__(*args, **kwargs)
+        self.captcha_expirado = False
+        operandos = None
+        if self.is_bound:
+            try:
+                operandos = signing.loads(
+                    self.data.get('captcha_token', ''),
+                    salt=self.CAPTCHA_SALT,
+                    max_age=self.CAPTCHA_MAX_AGE
+                )
+            except signing.BadSignature:
+                self.captcha_expirado = True
+        
+        if operandos:
+            self.captcha_a, self.captcha_b = operandos
+        else:
+            self.captcha_a = random.randint(1, 10)
+            self.captcha_b = random.randint(1, 10)
+            token = signing.dumps((self.captcha_a, self.captcha_b), salt=self.CAPTCHA_SALT)
+            self.fields['captcha_token'].initial = token
+            if self.is_bound:
+                # Re-renderizar con una operación nueva si la anterior no es válida
+                self.data = self.data.copy()
+                self.data['captcha_token'] = token
         self.fields['captcha_respuesta'].label = f"¿Cuánto es {self.captcha_a} + {self.captcha_b}?"
     
     def clean_captcha_respuesta(self):
         respuesta = self.cleaned_data.get('captcha_respuesta')
-        if respuesta != self.captcha_respuesta_correcta:
+        if self.captcha_expirado:
+            raise forms.ValidationError("La verificación expiró. Resuelva la nueva operación.")
+        if respuesta != self.captcha_a + self.captcha_b:
             raise forms.ValidationError("Respuesta incorrecta. Intente nuevamente.")
         return respuesta
 
@@ -412,8 +514,8 @@ class TimbradoForm(forms.ModelForm):
         timbrado = self.cleaned_data.get('timbrado')
         if not timbrado:
             return timbrado
-        timbrado = timbrado.strip().replace('-', '').replace(' ', '')
-        if not re.match(r'^\d{8,15}$', timbrado):
+        timbrado = timbrado.strip().translate(_TIMBRADO_STRIP)
+        if not TIMBRADO_RE.match(timbrado):
             raise forms.ValidationError("Formato de timbrado inválido (8-15 dígitos).")
         return timbrado
 
@@ -481,13 +583,13 @@ class TimbradoConfigForm(forms.ModelForm):
     
     def clean_establecimiento(self):
         establecimiento = self.cleaned_data.get('establecimiento')
-        if not re.match(r'^\d{3}$', establecimiento):
+        if not _THREE_DIGITS_RE.match(establecimiento):
             raise forms.ValidationError('Debe ser exactamente 3 dígitos numéricos (ej: 001)')
         return establecimiento
     
     def clean_punto_expedicion(self):
         punto = self.cleaned_data.get('punto_expedicion')
-        if not re.match(r'^\d{3}$', punto):
+        if not _THREE_DIGITS_RE.match(punto):
             raise forms.ValidationError('Debe ser exactamente 3 dígitos numéricos (ej: 001)')
         return punto
     
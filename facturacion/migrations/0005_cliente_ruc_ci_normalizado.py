@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-15 20:34
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+def normalizar_ruc_ci(apps, schema_editor):
+    """Quita espacios y guiones del RUC/CI de los clientes existentes"""
+    Cliente = apps.get_model('facturacion', 'Cliente')
+    existentes = set(Cliente.objects.values_list('ruc_ci', flat=True))
+    for cliente in Cliente.objects.only('pk', 'ruc_ci'):
+        normalizado = cliente.ruc_ci.strip().replace(' ', '').replace('-', '')
+        if normalizado == cliente.ruc_ci or normalizado in existentes:
+            # Se deja igual si ya está normalizado o chocaría con otro cliente
+            continue
+        existentes.discard(cliente.ruc_ci)
+        existentes.add(normalizado)
+        Cliente.objects.filter(pk=cliente.pk).update(ruc_ci=normalizado)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facturacion', '0004_producto'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalizar_ruc_ci, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='cliente',
+            index=models.Index(django.db.models.functions.text.Upper('ruc_ci'), name='cliente_ruc_upper_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-15 20:37
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facturacion', '0005_cliente_ruc_ci_normalizado'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='cliente',
+            name='cliente_ruc_upper_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='cliente',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Upper('ruc_ci'), name='uniq_cliente_ruc_ci_ci', violation_error_message='Ya existe un cliente con este RUC/CI'),
+        ),
+    ]
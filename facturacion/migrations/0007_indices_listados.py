@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-15 20:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facturacion', '0006_cliente_ruc_ci_unique_ci'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cliente',
+            index=models.Index(fields=['activo', 'nombre'], name='cliente_activo_nombre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='factura',
+            index=models.Index(fields=['-fecha_emision'], name='factura_fecha_emision_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='factura',
+            index=models.Index(fields=['estado', '-fecha_emision'], name='factura_estado_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='factura',
+            index=models.Index(fields=['cliente', '-fecha_emision'], name='factura_cliente_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-15 20:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facturacion', '0007_indices_listados'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorFactura',
+            fields=[
+                ('prefijo', models.CharField(max_length=20, primary_key=True, serialize=False, verbose_name='Prefijo')),
+                ('ultimo_numero', models.BigIntegerField(default=0, verbose_name='Último Número')),
+            ],
+            options={
+                'verbose_name': 'Contador de Facturas',
+                'verbose_name_plural': 'Contadores de Facturas',
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-15 20:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facturacion', '0008_contador_factura'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='factura',
+            name='factura_fecha_emision_idx',
+        ),
+        migrations.AddIndex(
+            model_name='factura',
+            index=models.Index(fields=['-fecha_emision', '-numero_factura'], name='factura_listado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='factura',
+            index=models.Index(fields=['cliente', 'activo', 'estado'], name='factura_cliente_estado_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-15 20:46
+
+from django.db import migrations, models
+
+
+def dejar_un_timbrado_activo(apps, schema_editor):
+    """Si hubiera varias configuraciones activas, conserva solo la más reciente"""
+    TimbradoConfig = apps.get_model('facturacion', 'TimbradoConfig')
+    activas = TimbradoConfig.objects.filter(activo=True).order_by('-fecha_creacion', '-pk')
+    ultima = activas.values_list('pk', flat=True).first()
+    if ultima is not None:
+        activas.exclude(pk=ultima).update(activo=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facturacion', '0009_indices_totales_cliente'),
+    ]
+
+    operations = [
+        migrations.RunPython(dejar_un_timbrado_activo, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='timbradoconfig',
+            constraint=models.UniqueConstraint(condition=models.Q(('activo', True)), fields=('activo',), name='uniq_timbrado_activo', violation_error_message='Ya existe una configuración de timbrado activa. Desactive la anterior primero.'),
+        ),
+    ]
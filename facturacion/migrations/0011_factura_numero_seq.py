@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-15 20:51
+
+from django.db import migrations, models
+
+
+def separar_numeros_existentes(apps, schema_editor):
+    """Completa prefijo y contador a partir del numero_factura de cada factura"""
+    Factura = apps.get_model('facturacion', 'Factura')
+    for factura in Factura.objects.only('pk', 'numero_factura').iterator():
+        prefijo, guion, contador = factura.numero_factura.rpartition('-')
+        if guion and contador.isdigit():
+            Factura.objects.filter(pk=factura.pk).update(
+                numero_prefijo=prefijo + guion, numero_seq=int(contador)
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facturacion', '0010_timbrado_activo_unico'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='factura',
+            name='numero_prefijo',
+            field=models.CharField(blank=True, editable=False, help_text='Parte de numero_factura antes del contador (ej: 001-001-)', max_length=20, null=True, verbose_name='Prefijo de Numeración'),
+        ),
+        migrations.AddField(
+            model_name='factura',
+            name='numero_seq',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, help_text='Contador numérico de numero_factura', null=True, verbose_name='Contador de Numeración'),
+        ),
+        migrations.RunPython(separar_numeros_existentes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='factura',
+            index=models.Index(fields=['numero_prefijo', 'numero_seq'], name='factura_numeracion_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-15 20:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facturacion', '0011_factura_numero_seq'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='cliente',
+            constraint=models.CheckConstraint(check=models.Q(('ruc_ci', ''), _negated=True), name='cliente_ruc_ci_no_vacio', violation_error_message='El RUC/CI no puede estar vacío'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-15 21:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facturacion', '0012_cliente_ruc_ci_no_vacio'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='factura',
+            index=models.Index(fields=['activo', 'estado', 'fecha_emision'], name='factura_reporte_estado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='factura',
+            index=models.Index(fields=['activo', 'fecha_emision'], name='factura_reporte_fecha_idx'),
+        ),
+    ]
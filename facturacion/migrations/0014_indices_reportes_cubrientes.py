@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-15 21:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facturacion', '0013_indices_reportes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='factura',
+            name='factura_reporte_estado_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='factura',
+            name='factura_reporte_fecha_idx',
+        ),
+        migrations.AddIndex(
+            model_name='factura',
+            index=models.Index(fields=['activo', 'estado', 'fecha_emision', 'total'], name='factura_reporte_estado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='factura',
+            index=models.Index(fields=['activo', 'fecha_emision', 'estado', 'total'], name='factura_reporte_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-15 21:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facturacion', '0014_indices_reportes_cubrientes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='factura',
+            name='factura_estado_fecha_idx',
+        ),
+        migrations.AlterField(
+            model_name='factura',
+            name='cliente',
+            field=models.ForeignKey(db_index=False, help_text='Cliente al que se emite la factura', on_delete=django.db.models.deletion.PROTECT, related_name='facturas', to='facturacion.cliente', verbose_name='Cliente'),
+        ),
+    ]
@@ -1,16 +1,60 @@
 import re
-from django.db import models
+import time
+from django.db import DatabaseError, models, transaction
+from django.db.models import ExpressionWrapper, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round, Upper
 from django.urls import reverse
 from django.core.validators import MinValueValidator
 from django.core.exceptions import ValidationError
+from django.core.cache import cache
 from django.utils import timezone
-from decimal import Decimal
+from django.utils.functional import cached_property
+from decimal import Decimal, InvalidOperation
 from django.conf import settings
 from django.contrib.auth.models import User
 import logging
 
 logger = logging.getLogger(__name__)
 
+CLIENTES_ACTIVOS_CACHE_KEY = 'facturacion:clientes_activos_choices'
+PRODUCTOS_ACTIVOS_CACHE_KEY = 'facturacion:productos_activos_choices'
+PRODUCTO_PRECIO_CACHE_KEY = 'facturacion:producto_precio:%s'
+CHOICES_CACHE_TIMEOUT = 300
+TIMBRADO_ACTIVO_CACHE_KEY = 'facturacion:timbrado_activo'
+TIMBRADO_CACHE_TIMEOUT = 300
+DASHBOARD_CACHE_KEY = 'facturacion:dashboard'
+DASHBOARD_CACHE_TIMEOUT = 60
+REPORTES_VERSION_CACHE_KEY = 'facturacion:reportes_version'
+REPORTES_CACHE_TIMEOUT = 60
+
+# Tasa de IVA como Decimal exacto, calculada una sola vez al importar
+IVA_RATE = (Decimal(str(settings.IVA_PERCENTAGE)) / Decimal(100)).quantize(Decimal('0.0001'))
+
+# Compilado una sola vez al importar; lo comparten el modelo y TimbradoForm
+TIMBRADO_RE = re.compile(getattr(settings, 'TIMBRADO_REGEX', r'^\d{8,15}$'))
+
+
+_RUC_CI_STRIP = str.maketrans('', '', ' -')
+
+
+def normalizar_ruc_ci(ruc_ci):
+    """Quita espacios y guiones del RUC/CI"""
+    return str(ruc_ci).strip().translate(_RUC_CI_STRIP)
+
+
+def invalidar_estadisticas():
+    """Descarta el dashboard cacheado y cambia la versión que usan las claves de reportes"""
+    cache.delete(DASHBOARD_CACHE_KEY)
+    cache.set(REPORTES_VERSION_CACHE_KEY, time.time_ns(), None)
+
+
+def separar_numero_factura(numero):
+    """Divide 'EEE-PPP-XXXXXXXX' o 'FAC-XXXXXX' en (prefijo, contador); (None, None) si no termina en número"""
+    prefijo, guion, contador = (numero or '').rpartition('-')
+    if not guion or not contador.isdigit():
+        return None, None
+    return prefijo + guion, int(contador)
+
 
 class TimbradoConfig(models.Model):
     """Configuración global única de timbrado para el sistema"""
@@ -60,31 +104,40 @@ class TimbradoConfig(models.Model):
         verbose_name = "Configuración de Timbrado"
         verbose_name_plural = "Configuraciones de Timbrado"
         ordering = ['-fecha_creacion']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['activo'],
+                condition=models.Q(activo=True),
+                name='uniq_timbrado_activo',
+                violation_error_message='Ya existe una configuración de timbrado activa. Desactive la anterior primero.'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.establecimiento}-{self.punto_expedicion} (Vigente: {self.fecha_inicio} a {self.fecha_vencimiento})"
 
     def clean(self):
-        """Validar que solo exista una configuración activa"""
+        """Validar el rango de vigencia; la unicidad del activo la garantiza uniq_timbrado_activo"""
         super().clean()
-        if self.activo:
-            existe_activo = TimbradoConfig.objects.filter(activo=True)
-            if self.pk:
-                existe_activo = existe_activo.exclude(pk=self.pk)
-            if existe_activo.exists():
-                raise ValidationError('Ya existe una configuración de timbrado activa. Desactive la anterior primero.')
-        
         if self.fecha_vencimiento <= self.fecha_inicio:
             raise ValidationError({'fecha_vencimiento': 'La fecha de vencimiento debe ser posterior a la fecha de inicio'})
 
+    def validar_vigencia(self, hoy):
+        """Retorna (True, None) si el timbrado está vigente en hoy, o (False, motivo)"""
+        if hoy < self.fecha_inicio:
+            return False, f'El timbrado aún no está vigente (inicia el {self.fecha_inicio})'
+        if hoy > self.fecha_vencimiento:
+            return False, f'El timbrado está vencido (venció el {self.fecha_vencimiento})'
+        return True, None
+
     @staticmethod
     def get_activo():
-        """Retorna la configuración activa o None"""
-        try:
-            return TimbradoConfig.objects.filter(activo=True).first()
-        except Exception as e:
-            logger.error(f'Error obteniendo TimbradoConfig activo: {e}')
-            return None
+        """Retorna la configuración activa o None, cacheada entre requests junto con creado_por"""
+        return cache.get_or_set(
+            TIMBRADO_ACTIVO_CACHE_KEY,
+            lambda: TimbradoConfig.objects.select_related('creado_por').filter(activo=True).first(),
+            TIMBRADO_CACHE_TIMEOUT
+        )
 
 
 class Producto(models.Model):
@@ -108,6 +161,31 @@ class Producto(models.Model):
     def __str__(self):
         return f"{self.nombre} - ₲{self.precio:,.0f}"
 
+    @staticmethod
+    def opciones_activas():
+        """Retorna (pk, etiqueta) de los productos activos, cacheado entre requests"""
+        return cache.get_or_set(
+            PRODUCTOS_ACTIVOS_CACHE_KEY,
+            lambda: [
+                (pk, f"{nombre} - ₲{precio:,.0f}")
+                for pk, nombre, precio in Producto.objects.filter(activo=True).values_list('pk', 'nombre', 'precio')
+            ],
+            CHOICES_CACHE_TIMEOUT
+        )
+
+
+class ClienteQuerySet(models.QuerySet):
+    def with_stats(self):
+        """Anota n_facturas y total_pagado en la misma consulta del listado"""
+        return self.annotate(
+            n_facturas=models.Count('facturas', filter=models.Q(facturas__activo=True)),
+            total_pagado=Coalesce(
+                Sum('facturas__total', filter=models.Q(facturas__activo=True, facturas__estado='PAGADA')),
+                Value(Decimal('0')),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2)
+            )
+        )
+
 
 class Cliente(models.Model):
     """
@@ -129,13 +207,10 @@ class Cliente(models.Model):
         """Validación del modelo Cliente"""
         super().clean()
         if self.ruc_ci:
-            try:
-                ruc_ci_clean = str(self.ruc_ci).strip()
-                if not ruc_ci_clean:
-                    raise ValidationError({'ruc_ci': 'El RUC/CI no puede estar vacío'})
-            except (AttributeError, TypeError) as e:
-                logger.error(f'Error validando RUC/CI en modelo Cliente: {e}')
-                raise ValidationError({'ruc_ci': 'Formato de RUC/CI inválido'})
+            # Guardar normalizado para que las búsquedas exactas usen el índice
+            self.ruc_ci = normalizar_ruc_ci(self.ruc_ci)
+            if not self.ruc_ci:
+                raise ValidationError({'ruc_ci': 'El RUC/CI no puede estar vacío'})
     direccion = models.CharField(
         max_length=300,
         verbose_name="Dirección",
@@ -166,10 +241,27 @@ class Cliente(models.Model):
         verbose_name="Última Actualización"
     )
 
+    objects = ClienteQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Cliente"
         verbose_name_plural = "Clientes"
         ordering = ['nombre']
+        indexes = [
+            models.Index(fields=['activo', 'nombre'], name='cliente_activo_nombre_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                Upper('ruc_ci'),
+                name='uniq_cliente_ruc_ci_ci',
+                violation_error_message='Ya existe un cliente con este RUC/CI'
+            ),
+            models.CheckConstraint(
+                check=~models.Q(ruc_ci=''),
+                name='cliente_ruc_ci_no_vacio',
+                violation_error_message='El RUC/CI no puede estar vacío'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.nombre} - {self.ruc_ci}"
@@ -177,26 +269,49 @@ class Cliente(models.Model):
     def get_absolute_url(self):
         return reverse('facturacion:cliente_detalle', kwargs={'pk': self.pk})
 
+    @staticmethod
+    def opciones_activas():
+        """Retorna (pk, etiqueta) de los clientes activos, cacheado entre requests"""
+        return cache.get_or_set(
+            CLIENTES_ACTIVOS_CACHE_KEY,
+            lambda: [
+                (cliente.pk, str(cliente))
+                for cliente in Cliente.objects.filter(activo=True).only('pk', 'nombre', 'ruc_ci').order_by('nombre')
+            ],
+            CHOICES_CACHE_TIMEOUT
+        )
+
+    @cached_property
+    def _estadisticas(self):
+        """Cantidad de facturas y monto pagado, calculados en una sola consulta"""
+        return Cliente.objects.with_stats().values('n_facturas', 'total_pagado').get(pk=self.pk)
+
     def total_facturas(self):
-        """Retorna el total de facturas del cliente"""
-        try:
-            return self.facturas.filter(activo=True).count()
-        except Exception as e:
-            logger.error(f'Error calculando total facturas para cliente {self.pk}: {e}')
-            return 0
+        """Retorna el total de facturas del cliente (anotado por with_stats si está)"""
+        n_facturas = getattr(self, 'n_facturas', None)
+        if n_facturas is not None:
+            return n_facturas
+        return self._estadisticas['n_facturas']
 
     def total_facturado(self):
-        """Retorna el monto total facturado al cliente"""
-        try:
-            return self.facturas.filter(
-                activo=True,
-                estado='PAGADA'
-            ).aggregate(
-                total=models.Sum('total')
-            )['total'] or Decimal('0')
-        except Exception as e:
-            logger.error(f'Error calculando total facturado para cliente {self.pk}: {e}')
-            return Decimal('0')
+        """Retorna el monto total facturado al cliente (anotado por with_stats si está)"""
+        total_pagado = getattr(self, 'total_pagado', None)
+        if total_pagado is not None:
+            return total_pagado
+        return self._estadisticas['total_pagado']
+
+
+class FacturaQuerySet(models.QuerySet):
+    def with_related(self):
+        """Trae cliente y detalles para la vista de detalle sin consultas por fila"""
+        return self.select_related('cliente').prefetch_related(
+            models.Prefetch(
+                'detalles',
+                queryset=DetalleFactura.objects.only(
+                    'id', 'factura_id', 'producto', 'cantidad', 'precio_unitario', 'subtotal'
+                )
+            )
+        )
 
 
 class Factura(models.Model):
@@ -215,10 +330,27 @@ class Factura(models.Model):
         verbose_name="Número de Factura",
         help_text="Número único de la factura"
     )
+    numero_prefijo = models.CharField(
+        max_length=20,
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name="Prefijo de Numeración",
+        help_text="Parte de numero_factura antes del contador (ej: 001-001-)"
+    )
+    numero_seq = models.PositiveBigIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name="Contador de Numeración",
+        help_text="Contador numérico de numero_factura"
+    )
     cliente = models.ForeignKey(
         Cliente,
         on_delete=models.PROTECT,
         related_name='facturas',
+        # Lo cubren los índices compuestos que empiezan por cliente
+        db_index=False,
         verbose_name="Cliente",
         help_text="Cliente al que se emite la factura"
     )
@@ -316,28 +448,73 @@ class Factura(models.Model):
         verbose_name="Última Actualización"
     )
 
+    objects = FacturaQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Factura"
         verbose_name_plural = "Facturas"
         ordering = ['-fecha_emision', '-numero_factura']
+        indexes = [
+            models.Index(fields=['-fecha_emision', '-numero_factura'], name='factura_listado_idx'),
+            models.Index(fields=['cliente', '-fecha_emision'], name='factura_cliente_fecha_idx'),
+            models.Index(fields=['cliente', 'activo', 'estado'], name='factura_cliente_estado_idx'),
+            models.Index(fields=['numero_prefijo', 'numero_seq'], name='factura_numeracion_idx'),
+            # Reportes: activo=True, estado opcional y rango de fecha_emision; estado y total
+            # al final cubren el aggregate, que se resuelve sin leer filas de la tabla
+            models.Index(fields=['activo', 'estado', 'fecha_emision', 'total'], name='factura_reporte_estado_idx'),
+            models.Index(fields=['activo', 'fecha_emision', 'estado', 'total'], name='factura_reporte_fecha_idx'),
+        ]
 
     def __str__(self):
         return f"Factura {self.numero_factura} - {self.cliente.nombre}"
 
+    def save(self, *args, **kwargs):
+        """Guarda prefijo y contador del número para buscar el último emitido sin parsear cadenas"""
+        self.numero_prefijo, self.numero_seq = separar_numero_factura(self.numero_factura)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'numero_factura' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'numero_prefijo', 'numero_seq'}
+        super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         return reverse('facturacion:factura_detalle', kwargs={'pk': self.pk})
 
     def calcular_totales(self):
-        """Calcula subtotal, IVA y total basado en los detalles"""
+        """
+        Calcula subtotal, IVA y total basado en los detalles. La suma y la
+        escritura se hacen en un solo UPDATE con subconsulta, sin leer los
+        detalles en Python. También avanza fecha_actualizacion, que invalida
+        el PDF cacheado
+        """
+        monto = models.DecimalField(max_digits=12, decimal_places=2)
+        suma_detalles = Subquery(
+            DetalleFactura.objects.filter(factura=OuterRef('pk'))
+            .values('factura')
+            .annotate(s=Sum('subtotal'))
+            .values('s')[:1]
+        )
+        # subtotal e iva se arman una vez y se reusan en las tres columnas
+        subtotal = Coalesce(suma_detalles, Value(Decimal('0')), output_field=monto)
+        iva = Round(ExpressionWrapper(subtotal * Value(IVA_RATE), output_field=monto), 2)
         try:
-            detalles = self.detalles.all()
-            self.subtotal = sum(detalle.subtotal for detalle in detalles)
-            self.iva = self.subtotal * Decimal(str(settings.IVA_PERCENTAGE / 100))
-            self.total = self.subtotal + self.iva
-            self.save(update_fields=['subtotal', 'iva', 'total'])
-        except Exception as e:
-            logger.error(f'Error calculando totales para factura {self.pk}: {e}')
+            Factura.objects.filter(pk=self.pk).update(
+                subtotal=subtotal,
+                iva=iva,
+                total=ExpressionWrapper(subtotal + iva, output_field=monto),
+                fecha_actualizacion=timezone.now()
+            )
+        except DatabaseError as e:
+            logger.error('Error calculando totales para factura %s: %s', self.pk, e)
             raise ValidationError('Error al calcular totales de la factura')
+        invalidar_estadisticas()
+        self.refresh_from_db(fields=['subtotal', 'iva', 'total', 'fecha_actualizacion'])
+
+    @classmethod
+    def recalcular_bulk(cls, detalles):
+        """Recalcula una sola vez los totales de cada factura afectada por los detalles"""
+        factura_ids = {detalle.factura_id for detalle in detalles if detalle.factura_id}
+        for factura in cls.objects.filter(pk__in=factura_ids):
+            factura.calcular_totales()
 
     def puede_editarse(self):
         """Verifica si la factura puede editarse"""
@@ -347,15 +524,21 @@ class Factura(models.Model):
         """Verifica si la factura puede anularse"""
         return self.estado != 'ANULADA'
 
+    def _cambiar_estado(self, estado):
+        """Actualiza solo estado y fecha de actualización con un UPDATE por pk"""
+        ahora = timezone.now()
+        Factura.objects.filter(pk=self.pk).update(estado=estado, fecha_actualizacion=ahora)
+        invalidar_estadisticas()
+        self.estado = estado
+        self.fecha_actualizacion = ahora
+
     def marcar_pagada(self):
         """Marca la factura como pagada"""
-        self.estado = 'PAGADA'
-        self.save()
+        self._cambiar_estado('PAGADA')
 
     def anular(self):
         """Anula la factura"""
-        self.estado = 'ANULADA'
-        self.save()
+        self._cambiar_estado('ANULADA')
 
     def get_estado_color(self):
         """Retorna el color del badge según el estado"""
@@ -374,31 +557,20 @@ class Factura(models.Model):
         if not self.tiene_timbrado():
             return False
         
-        try:
-            hoy = timezone.now().date()
-            
-            if self.timbrado_fecha and self.fecha_emision < self.timbrado_fecha:
-                return False
-            
-            if self.timbrado_vencimiento and self.fecha_emision > self.timbrado_vencimiento:
-                return False
-            
-            return True
-        except Exception as e:
-            logger.error(f'Error verificando vigencia de timbrado para factura {self.pk}: {e}')
+        if self.timbrado_fecha and self.fecha_emision < self.timbrado_fecha:
+            return False
+        
+        if self.timbrado_vencimiento and self.fecha_emision > self.timbrado_vencimiento:
             return False
+        
+        return True
     
     def validar_timbrado_formato(self):
         """Validación básica del formato de timbrado"""
         if not self.timbrado:
             return True
         
-        try:
-            regex_pattern = getattr(settings, 'TIMBRADO_REGEX', r'^\d{8,15}$')
-            return bool(re.match(regex_pattern, self.timbrado))
-        except Exception as e:
-            logger.error(f'Error validando formato de timbrado: {e}')
-            return False
+        return bool(TIMBRADO_RE.match(self.timbrado))
     @staticmethod
     def generar_numero_factura():
         """Genera el siguiente número de factura en formato paraguayo EEE-PPP-XXXXXXXX"""
@@ -407,49 +579,77 @@ class Factura(models.Model):
             
             if not config:
                 logger.warning('No existe TimbradoConfig activo, usando formato antiguo FAC-XXXXXX')
-                from django.db.models import Max
-                ultima_factura = Factura.objects.aggregate(
-                    max_numero=Max('numero_factura')
-                )['max_numero']
-                
-                if ultima_factura:
-                    try:
-                        ultimo_numero = int(ultima_factura.split('-')[-1])
-                        nuevo_numero = ultimo_numero + 1
-                    except (ValueError, IndexError, AttributeError):
-                        nuevo_numero = getattr(settings, 'NUMERO_FACTURA_INICIO', 1000)
-                else:
-                    nuevo_numero = getattr(settings, 'NUMERO_FACTURA_INICIO', 1000)
-                
+                nuevo_numero = ContadorFactura.siguiente('FAC-', Factura._ultimo_numero_fac)
                 return f"FAC-{nuevo_numero:06d}"
             
             # Formato paraguayo: EEE-PPP-XXXXXXXX
             prefix = f"{config.establecimiento}-{config.punto_expedicion}-"
-            
-            # Buscar última factura con este prefijo
-            from django.db.models import Max
-            ultima_con_prefix = Factura.objects.filter(
-                numero_factura__startswith=prefix
-            ).aggregate(max_numero=Max('numero_factura'))['max_numero']
-            
-            if ultima_con_prefix:
-                try:
-                    # Extraer el contador del formato EEE-PPP-XXXXXXXX
-                    ultimo_contador = int(ultima_con_prefix.split('-')[-1])
-                    nuevo_contador = ultimo_contador + 1
-                except (ValueError, IndexError):
-                    nuevo_contador = 1
-            else:
-                nuevo_contador = 1
+            nuevo_contador = ContadorFactura.siguiente(
+                prefix, lambda: Factura._ultimo_contador_prefijo(prefix)
+            )
             
             # Formatear contador con 8 dígitos
             return f"{prefix}{nuevo_contador:08d}"
             
         except Exception as e:
-            logger.error(f'Error generando número de factura: {e}')
+            logger.error('Error generando número de factura: %s', e)
             import time
             return f"FAC-{int(time.time())}"
 
+    @staticmethod
+    def _ultimo_numero_fac():
+        """Último número FAC-XXXXXX emitido, para inicializar su contador"""
+        ultimo = Factura._ultimo_contador_prefijo('FAC-')
+        return ultimo or getattr(settings, 'NUMERO_FACTURA_INICIO', 1000) - 1
+    
+    @staticmethod
+    def _ultimo_contador_prefijo(prefix):
+        """Último contador emitido con el prefijo EEE-PPP-, para inicializar su contador"""
+        return Factura.objects.filter(
+            numero_prefijo=prefix
+        ).aggregate(max_numero=Max('numero_seq'))['max_numero'] or 0
+
+
+class ContadorFactura(models.Model):
+    """Último número de factura emitido por cada prefijo de numeración"""
+    prefijo = models.CharField(max_length=20, primary_key=True, verbose_name="Prefijo")
+    ultimo_numero = models.BigIntegerField(default=0, verbose_name="Último Número")
+
+    class Meta:
+        verbose_name = "Contador de Facturas"
+        verbose_name_plural = "Contadores de Facturas"
+
+    def __str__(self):
+        return f"{self.prefijo}{self.ultimo_numero}"
+
+    @staticmethod
+    def siguiente(prefijo, ultimo_emitido):
+        """
+        Incrementa y retorna el contador del prefijo. El UPDATE bloquea la fila
+        hasta que termine la transacción que emite la factura, así dos facturas
+        simultáneas no reciben el mismo número. Si el contador no existe se
+        inicializa con ultimo_emitido()
+        """
+        contador = ContadorFactura.objects.filter(pk=prefijo)
+        with transaction.atomic():
+            # Caso habitual: el contador ya existe y basta un UPDATE
+            if not contador.update(ultimo_numero=F('ultimo_numero') + 1):
+                _, creado = ContadorFactura.objects.get_or_create(
+                    prefijo=prefijo, defaults={'ultimo_numero': lambda: ultimo_emitido() + 1}
+                )
+                if not creado:
+                    contador.update(ultimo_numero=F('ultimo_numero') + 1)
+            return contador.values_list('ultimo_numero', flat=True).get()
+
+
+class DetalleFacturaQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        """bulk_create no llama a save(): calcula aquí el subtotal de cada línea"""
+        objs = list(objs)
+        for detalle in objs:
+            detalle.calcular_subtotal()
+        return super().bulk_create(objs, *args, **kwargs)
+
 
 class DetalleFactura(models.Model):
     """
@@ -486,6 +686,8 @@ class DetalleFactura(models.Model):
         help_text="Cantidad × Precio Unitario"
     )
 
+    objects = DetalleFacturaQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Detalle de Factura"
         verbose_name_plural = "Detalles de Factura"
@@ -494,14 +696,19 @@ class DetalleFactura(models.Model):
     def __str__(self):
         return f"{self.producto} - {self.cantidad} × ₲{self.precio_unitario}"
 
+    def calcular_subtotal(self):
+        """Calcula el subtotal de la línea (cantidad × precio unitario)"""
+        self.subtotal = Decimal(str(self.cantidad)) * self.precio_unitario
+
     def save(self, *args, **kwargs):
-        """Calcula el subtotal antes de guardar"""
+        """
+        Calcula el subtotal antes de guardar. Los totales de la factura no se
+        recalculan aquí: quien guarda los detalles llama a calcular_totales()
+        una vez al terminar
+        """
         try:
-            self.subtotal = Decimal(str(self.cantidad)) * self.precio_unitario
-            super().save(*args, **kwargs)
-            # Actualizar totales de la factura
-            if self.factura_id:
-                self.factura.calcular_totales()
-        except Exception as e:
-            logger.error(f'Error guardando detalle de factura: {e}')
-            raise ValidationError('Error al guardar el detalle de la factura')
\ No newline at end of file
+            self.calcular_subtotal()
+        except (TypeError, InvalidOperation) as e:
+            logger.error('Error calculando subtotal del detalle de factura: %s', e)
+            raise ValidationError('Error al guardar el detalle de la factura')
+        super().save(*args, **kwargs)
\ No newline at end of file
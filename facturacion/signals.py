@@ -0,0 +1,56 @@
+"""
+Señales del sistema de facturación: normalización de datos, invalidación de
+cachés y ajustes de cada conexión SQLite
+"""
+from django.core.cache import cache
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from .models import (
+    Cliente, Factura, Producto, TimbradoConfig, normalizar_ruc_ci, invalidar_estadisticas,
+    CLIENTES_ACTIVOS_CACHE_KEY, PRODUCTOS_ACTIVOS_CACHE_KEY, PRODUCTO_PRECIO_CACHE_KEY,
+    TIMBRADO_ACTIVO_CACHE_KEY
+)
+
+
+@receiver(pre_save, sender=Cliente)
+def normalizar_cliente_ruc_ci(sender, instance, **kwargs):
+    """Guarda el RUC/CI sin espacios ni guiones aunque no pase por un formulario"""
+    if instance.ruc_ci:
+        instance.ruc_ci = normalizar_ruc_ci(instance.ruc_ci)
+
+
+@receiver([post_save, post_delete], sender=Cliente)
+def invalidar_clientes_activos(sender, **kwargs):
+    """Descarta la lista cacheada de clientes activos"""
+    cache.delete(CLIENTES_ACTIVOS_CACHE_KEY)
+
+
+@receiver([post_save, post_delete], sender=Producto)
+def invalidar_productos_activos(sender, instance, **kwargs):
+    """Descarta la lista cacheada de productos activos y el precio cacheado del producto"""
+    cache.delete_many([PRODUCTOS_ACTIVOS_CACHE_KEY, PRODUCTO_PRECIO_CACHE_KEY % instance.pk])
+
+
+@receiver([post_save, post_delete], sender=TimbradoConfig)
+def invalidar_timbrado_activo(sender, **kwargs):
+    """Descarta la configuración de timbrado activa cacheada"""
+    cache.delete(TIMBRADO_ACTIVO_CACHE_KEY)
+
+
+@receiver([post_save, post_delete], sender=Factura)
+@receiver([post_save, post_delete], sender=Cliente)
+def invalidar_estadisticas_cacheadas(sender, **kwargs):
+    """Descarta las estadísticas cacheadas del dashboard y los reportes"""
+    invalidar_estadisticas()
+
+
+@receiver(connection_created)
+def configurar_sqlite(sender, connection, **kwargs):
+    """WAL para que los reportes no bloqueen ni queden bloqueados por las escrituras"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA temp_store=MEMORY')
@@ -0,0 +1,13 @@
+"""
+Filtros de plantilla del sistema de facturación
+"""
+from django import template
+from ..utils import formatear_monto
+
+register = template.Library()
+
+
+@register.filter
+def monto(valor):
+    """Formatea un monto en guaraníes igual que en los PDF"""
+    return formatear_monto(valor)
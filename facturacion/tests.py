@@ -1,10 +1,14 @@
 from django.test import TestCase
 from django.test import TestCase, Client
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.urls import reverse
-from .models import Cliente, Factura
+from .models import Cliente, Factura, DetalleFactura
 from datetime import date, timedelta
+from decimal import Decimal
 import os
+import time
+from unittest import mock
 from django.conf import settings
 
 class FacturaAnularCaptchaTest(TestCase):
@@ -46,14 +50,13 @@ class FacturaAnularCaptchaTest(TestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
         
-        # Obtener valores del captcha de la sesión
-        session = self.client.session
-        captcha_a = session['captcha_a']
-        captcha_b = session['captcha_b']
-        respuesta_correcta = captcha_a + captcha_b
+        # Obtener la operación y el token firmado del formulario
+        form = response.context['form']
+        respuesta_correcta = form.captcha_a + form.captcha_b
         
         # POST con respuesta correcta
         response = self.client.post(url, {
+            'captcha_token': form['captcha_token'].value(),
             'captcha_respuesta': respuesta_correcta
         })
         
@@ -68,9 +71,11 @@ class FacturaAnularCaptchaTest(TestCase):
         
         # GET para obtener el captcha
         response = self.client.get(url)
+        token = response.context['form']['captcha_token'].value()
         
         # POST con respuesta incorrecta
         response = self.client.post(url, {
+            'captcha_token': token,
             'captcha_respuesta': 99999  # Respuesta incorrecta
         })
         
@@ -82,6 +87,19 @@ class FacturaAnularCaptchaTest(TestCase):
         messages = list(response.context['messages'])
         self.assertTrue(any('incorrecto' in str(m) for m in messages))
     
+    def test_captcha_token_alterado_no_anula_factura(self):
+        """Test: Un token de captcha manipulado NO debe anular la factura"""
+        url = reverse('facturacion:factura_anular', kwargs={'pk': self.factura.pk})
+        
+        response = self.client.post(url, {
+            'captcha_token': 'token-invalido',
+            'captcha_respuesta': 2
+        })
+        
+        self.assertEqual(response.status_code, 200)
+        self.factura.refresh_from_db()
+        self.assertEqual(self.factura.estado, 'PENDIENTE')
+    
     def test_factura_ya_anulada_no_permite_anular(self):
         """Test: No se puede anular una factura ya anulada"""
         self.factura.estado = 'ANULADA'
@@ -99,6 +117,8 @@ class LoginSeparadoTest(TestCase):
     
     def setUp(self):
         """Configuración inicial para los tests"""
+        # Los intentos fallidos por IP se cuentan en cache y sobreviven al rollback
+        cache.clear()
         self.client = Client()
         
         # Crear usuario normal
@@ -171,6 +191,67 @@ class LoginSeparadoTest(TestCase):
         # Verificar mensaje de error
         messages = list(response.wsgi_request._messages)
         self.assertTrue(any('Acceso denegado' in str(m) for m in messages))
+    
+    def _fallar_login(self, url, veces):
+        """Envía credenciales incorrectas la cantidad de veces indicada"""
+        for _ in range(veces):
+            self.client.post(url, {'username': 'usuario_normal', 'password': 'incorrecta'})
+    
+    def test_login_bloqueado_tras_fallos(self):
+        """Test: Tras 5 fallos desde la misma IP se rechaza el siguiente intento"""
+        url = reverse('facturacion:login')
+        self._fallar_login(url, 5)
+        
+        response = self.client.post(url, {
+            'username': 'usuario_normal',
+            'password': 'pass123'
+        })
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.wsgi_request.user.is_authenticated)
+        messages = list(response.context['messages'])
+        self.assertTrue(any('Demasiados intentos' in str(m) for m in messages))
+    
+    def test_login_exitoso_reinicia_fallos(self):
+        """Test: Un login correcto reinicia el contador de fallos"""
+        url = reverse('facturacion:login')
+        self._fallar_login(url, 4)
+        self.client.post(url, {'username': 'usuario_normal', 'password': 'pass123'})
+        self.client.logout()
+        self._fallar_login(url, 4)
+        
+        response = self.client.post(url, {
+            'username': 'usuario_normal',
+            'password': 'pass123'
+        })
+        
+        self.assertRedirects(response, reverse('facturacion:dashboard'))
+    
+    def test_login_bloqueo_expira(self):
+        """Test: El bloqueo se levanta al vencer la ventana de 60 segundos"""
+        url = reverse('facturacion:login')
+        self._fallar_login(url, 5)
+        
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=time.time() + 61):
+            response = self.client.post(url, {
+                'username': 'usuario_normal',
+                'password': 'pass123'
+            })
+        
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.wsgi_request.user.is_authenticated)
+    
+    def test_login_admin_comparte_contador(self):
+        """Test: Los fallos en /login/ también bloquean /login-admin/ desde la misma IP"""
+        self._fallar_login(reverse('facturacion:login'), 5)
+        
+        response = self.client.post(reverse('facturacion:login_admin'), {
+            'username': 'admin_user',
+            'password': 'admin123'
+        })
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.wsgi_request.user.is_authenticated)
 
 
 class TimbradoConfigTest(TestCase):
@@ -178,6 +259,8 @@ class TimbradoConfigTest(TestCase):
     
     def setUp(self):
         """Configuración inicial"""
+        # El timbrado activo se cachea y el rollback de cada test no lo invalida
+        cache.clear()
         self.user_admin = User.objects.create_user(
             username='admin_test',
             password='admin123',
@@ -255,6 +338,46 @@ class TimbradoConfigTest(TestCase):
         
         self.assertEqual(factura2.numero_factura, '001-001-00000002')
     
+    def test_get_activo_cacheado_se_invalida_al_guardar(self):
+        """Test: get_activo no consulta la BD mientras el timbrado no cambie"""
+        from .models import TimbradoConfig
+        
+        config = TimbradoConfig.objects.create(
+            establecimiento='001',
+            punto_expedicion='001',
+            fecha_inicio=date.today(),
+            fecha_vencimiento=date.today() + timedelta(days=365),
+            activo=True,
+            creado_por=self.user_admin
+        )
+        self.assertEqual(TimbradoConfig.get_activo(), config)
+        with self.assertNumQueries(0):
+            TimbradoConfig.get_activo()
+        
+        config.activo = False
+        config.save()
+        self.assertIsNone(TimbradoConfig.get_activo())
+    
+    def test_validar_vigencia(self):
+        """Test: validar_vigencia rechaza fechas fuera del rango del timbrado"""
+        from .models import TimbradoConfig
+        
+        hoy = date.today()
+        config = TimbradoConfig(
+            establecimiento='001',
+            punto_expedicion='001',
+            fecha_inicio=hoy,
+            fecha_vencimiento=hoy + timedelta(days=365)
+        )
+        
+        self.assertEqual(config.validar_vigencia(hoy), (True, None))
+        vigente, motivo = config.validar_vigencia(hoy - timedelta(days=1))
+        self.assertFalse(vigente)
+        self.assertIn('aún no está vigente', motivo)
+        vigente, motivo = config.validar_vigencia(hoy + timedelta(days=366))
+        self.assertFalse(vigente)
+        self.assertIn('vencido', motivo)
+    
     def test_fallback_sin_timbrado(self):
         """Test: Sin configuración de timbrado, usar formato antiguo FAC-XXXXXX"""
         # No crear TimbradoConfig
@@ -275,6 +398,121 @@ class TimbradoConfigTest(TestCase):
         
         # Debe empezar con FAC-
         self.assertTrue(factura.numero_factura.startswith('FAC-'))
+    
+    def test_añadir_timbrado_a_factura(self):
+        """Test: Un timbrado válido se normaliza y se guarda en la factura"""
+        cliente = Cliente.objects.create(
+            nombre="Cliente Test",
+            ruc_ci="12345678-9",
+            direccion="Dirección Test",
+            telefono="0981123456"
+        )
+        
+        factura = Factura.objects.create(
+            numero_factura=Factura.generar_numero_factura(),
+            cliente=cliente,
+            fecha_emision=date.today(),
+            estado='PENDIENTE'
+        )
+        
+        url = reverse('facturacion:factura_timbrado', kwargs={'pk': factura.pk})
+        response = self.client.post(url, {
+            'timbrado': ' 1234-5678 ',
+            'timbrado_fecha': date.today().isoformat(),
+            'timbrado_vencimiento': (date.today() + timedelta(days=365)).isoformat(),
+        })
+        
+        self.assertRedirects(response, reverse('facturacion:factura_detalle', kwargs={'pk': factura.pk}))
+        factura.refresh_from_db()
+        self.assertEqual(factura.timbrado, '12345678')
+        self.assertEqual(factura.timbrado_por, self.user_admin)
+
+
+class FacturaPdfCacheTest(TestCase):
+    """Tests para el PDF de factura cacheado"""
+    
+    def setUp(self):
+        """Configuración inicial"""
+        cache.clear()
+        self.user_admin = User.objects.create_superuser(
+            username='admin_test',
+            password='admin123'
+        )
+        self.client = Client()
+        self.client.login(username='admin_test', password='admin123')
+        
+        cliente = Cliente.objects.create(
+            nombre="Cliente Test",
+            ruc_ci="12345678-9",
+            direccion="Dirección Test",
+            telefono="0981123456"
+        )
+        
+        self.factura = Factura.objects.create(
+            numero_factura=Factura.generar_numero_factura(),
+            cliente=cliente,
+            fecha_emision=date.today(),
+            estado='PENDIENTE'
+        )
+    
+    def test_accion_admin_regenera_pdf(self):
+        """Test: Marcar como pagada desde el admin no debe servir el PDF anterior"""
+        url_pdf = reverse('facturacion:factura_pdf', kwargs={'pk': self.factura.pk})
+        pdf_pendiente = self.client.get(url_pdf).content
+        
+        response = self.client.post(reverse('admin:facturacion_factura_changelist'), {
+            'action': 'marcar_como_pagada',
+            '_selected_action': [self.factura.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.factura.refresh_from_db()
+        self.assertEqual(self.factura.estado, 'PAGADA')
+        
+        self.assertNotEqual(self.client.get(url_pdf).content, pdf_pendiente)
+
+
+class FacturaTotalesTest(TestCase):
+    """Tests para el cálculo de totales de la factura"""
+    
+    def setUp(self):
+        """Configuración inicial"""
+        cliente = Cliente.objects.create(
+            nombre="Cliente Test",
+            ruc_ci="12345678-9",
+            direccion="Dirección Test",
+            telefono="0981123456"
+        )
+        
+        self.factura = Factura.objects.create(
+            numero_factura=Factura.generar_numero_factura(),
+            cliente=cliente,
+            fecha_emision=date.today(),
+            estado='PENDIENTE'
+        )
+    
+    def test_totales_varias_lineas(self):
+        """Test: Subtotal, IVA redondeado y total exactos con varias líneas"""
+        for producto in ('Producto A', 'Producto B', 'Producto C'):
+            DetalleFactura.objects.create(
+                factura=self.factura,
+                producto=producto,
+                cantidad=1,
+                precio_unitario=Decimal('12345.67')
+            )
+        
+        self.factura.calcular_totales()
+        
+        self.assertEqual(self.factura.subtotal, Decimal('37037.01'))
+        self.assertEqual(self.factura.iva, Decimal('3703.70'))
+        self.assertEqual(self.factura.total, Decimal('40740.71'))
+    
+    def test_totales_factura_sin_detalles(self):
+        """Test: Una factura sin detalles queda en cero"""
+        self.factura.calcular_totales()
+        
+        self.assertEqual(self.factura.subtotal, Decimal('0'))
+        self.assertEqual(self.factura.iva, Decimal('0'))
+        self.assertEqual(self.factura.total, Decimal('0'))
 
 
 # ==========================================
@@ -283,4 +521,6 @@ class TimbradoConfigTest(TestCase):
 # python manage.py test facturacion.tests.FacturaAnularCaptchaTest
 # python manage.py test facturacion.tests.LoginSeparadoTest
 # python manage.py test facturacion.tests.TimbradoConfigTest
+# python manage.py test facturacion.tests.FacturaPdfCacheTest
+# python manage.py test facturacion.tests.FacturaTotalesTest
 # Create your tests here.
@@ -1,37 +1,175 @@
 """
 Utilidades para el sistema de facturación EasyInvoice
 """
+from reportlab import rl_config
 from reportlab.lib.pagesizes import letter
 from reportlab.lib import colors
 from reportlab.lib.units import inch
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_CENTER, TA_RIGHT
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum, Value
+from django.db.models.functions import Coalesce
 from io import BytesIO
+from .models import Factura
 from decimal import Decimal
 import logging
 
 logger = logging.getLogger(__name__)
 
+# La validación de atributos de ReportLab solo sirve para depurar
+if not settings.DEBUG:
+    rl_config.shapeChecking = 0
 
-def generar_pdf_factura(factura):
+# PDF de factura cacheado; la clave cambia cuando se modifica la factura o el cliente
+PDF_FACTURA_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Opciones comunes de los documentos; invariant quita la fecha de creación
+# para que el mismo contenido produzca siempre los mismos bytes
+_DOC_OPCIONES = {
+    'pagesize': letter,
+    'pageCompression': int(settings.PDF_PAGE_COMPRESSION),
+    'invariant': 1,
+}
+
+# Formateadores usados en cada fila de las tablas; formatear_monto también lo usa
+# el email de la factura (filtro monto) para que ambos muestren el mismo número
+formatear_monto = "₲ {:,.0f}".format
+_ESTADO_DISPLAY = dict(Factura.ESTADO_CHOICES)
+
+# Filas de detalle del reporte de ventas; el total sale del agregado
+_REPORTE_MAX_FILAS = 50
+_REPORTE_ENCABEZADO = ('Nº Factura', 'Fecha', 'Cliente', 'Estado', 'Total')
+
+
+def _fmt_fecha(fecha):
+    """dd/mm/aaaa sin pasar por strftime"""
+    return f"{fecha.day:02d}/{fecha.month:02d}/{fecha.year}"
+
+
+# Estilos compartidos por todos los PDF: se construyen una sola vez
+_ESTILOS = None
+
+_INFO_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#ecf0f1')),
+    ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+    ('GRID', (0, 0), (-1, -1), 1, colors.grey)
+])
+
+# Fila de encabezado azul común a las tablas de detalle, resumen y reporte
+_ENCABEZADO_AZUL = [
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#3498db')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+]
+
+_DETALLES_TABLE_STYLE = TableStyle(_ENCABEZADO_AZUL + [
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTSIZE', (0, 0), (-1, 0), 11),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+])
+
+_DETALLES_ENCABEZADO = ('Producto/Servicio', 'Cantidad', 'Precio Unit.', 'Subtotal')
+_DETALLES_POR_TABLA = 40
+
+_TOTALES_TABLE_STYLE = TableStyle([
+    ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTNAME', (0, 2), (-1, 2), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 2), (-1, 2), 14),
+    ('TEXTCOLOR', (0, 2), (-1, 2), colors.HexColor('#2c3e50')),
+    ('LINEABOVE', (0, 2), (-1, 2), 2, colors.black),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+])
+
+_RESUMEN_TABLE_STYLE = TableStyle(_ENCABEZADO_AZUL + [
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+    ('GRID', (0, 0), (-1, -1), 1, colors.grey)
+])
+
+_REPORTE_TABLE_STYLE = TableStyle(_ENCABEZADO_AZUL + [
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTSIZE', (0, 0), (-1, -1), 8),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+])
+
+
+def _get_estilos():
+    """Hoja de estilos de ReportLab con los estilos propios, creada en el primer uso"""
+    global _ESTILOS
+    if _ESTILOS is None:
+        estilos = getSampleStyleSheet()
+        estilos.add(ParagraphStyle(
+            'TituloFactura',
+            parent=estilos['Heading1'],
+            fontSize=18,
+            textColor=colors.HexColor('#2c3e50'),
+            spaceAfter=30,
+            alignment=TA_CENTER
+        ))
+        estilos.add(ParagraphStyle(
+            'TituloReporte',
+            parent=estilos['Heading1'],
+            fontSize=16,
+            textColor=colors.HexColor('#2c3e50'),
+            spaceAfter=20,
+            alignment=TA_CENTER
+        ))
+        estilos.add(ParagraphStyle(
+            'Pie',
+            parent=estilos['Normal'],
+            fontSize=8,
+            textColor=colors.grey,
+            alignment=TA_CENTER
+        ))
+        _ESTILOS = estilos
+    return _ESTILOS
+
+
+def _pdf_factura_cache_key(factura):
+    """Clave del PDF según las últimas modificaciones de la factura y su cliente"""
+    return 'facturacion:pdf_factura:%s:%s:%s' % (
+        factura.pk,
+        factura.fecha_actualizacion.timestamp(),
+        factura.cliente.fecha_actualizacion.timestamp(),
+    )
+
+
+def generar_pdf_factura(factura, output=None):
     """
-    Genera un PDF de la factura en formato paraguayo
+    Genera un PDF de la factura en formato paraguayo.
+    Espera la factura con el cliente en select_related; si no lo trae se
+    vuelve a consultar. Los detalles se leen como tuplas solo si no hay cache.
+    El PDF se escribe en output (p. ej. el HttpResponse) o en un BytesIO nuevo,
+    y se guarda en cache hasta que cambie la factura o el cliente
     """
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    if 'cliente' not in factura._state.fields_cache:
+        factura = type(factura).objects.select_related('cliente').get(pk=factura.pk)
+    
+    buffer = BytesIO() if output is None else output
+    cache_key = _pdf_factura_cache_key(factura)
+    pdf = cache.get(cache_key)
+    if pdf is not None:
+        buffer.write(pdf)
+        if output is None:
+            buffer.seek(0)
+        return buffer
+    
+    doc = SimpleDocTemplate(buffer, **_DOC_OPCIONES)
     elements = []
-    styles = getSampleStyleSheet()
-    
-    # Estilo personalizado para el título
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        textColor=colors.HexColor('#2c3e50'),
-        spaceAfter=30,
-        alignment=TA_CENTER
-    )
+    styles = _get_estilos()
+    title_style = styles['TituloFactura']
     
     # Encabezado
     elements.append(Paragraph("SISTEMA EASYINVOICE", title_style))
@@ -41,25 +179,17 @@ def generar_pdf_factura(factura):
     # Información de la factura
     factura_info = [
         ['FACTURA', factura.numero_factura],
-        ['Fecha de Emisión:', factura.fecha_emision.strftime('%d/%m/%Y')],
-        ['Estado:', factura.get_estado_display()],
+        ['Fecha de Emisión:', _fmt_fecha(factura.fecha_emision)],
+        ['Estado:', _ESTADO_DISPLAY[factura.estado]],
     ]
     
     if factura.timbrado:
         factura_info.append(['Timbrado:', factura.timbrado])
         if factura.timbrado_vencimiento:
-            factura_info.append(['Válido hasta:', factura.timbrado_vencimiento.strftime('%d/%m/%Y')])
+            factura_info.append(['Válido hasta:', _fmt_fecha(factura.timbrado_vencimiento)])
     
     info_table = Table(factura_info, colWidths=[2*inch, 4*inch])
-    info_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#ecf0f1')),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-        ('GRID', (0, 0), (-1, -1), 1, colors.grey)
-    ]))
+    info_table.setStyle(_INFO_TABLE_STYLE)
     elements.append(info_table)
     elements.append(Spacer(1, 0.3*inch))
     
@@ -75,61 +205,40 @@ def generar_pdf_factura(factura):
         cliente_info.append(['Email:', factura.cliente.email])
     
     cliente_table = Table(cliente_info, colWidths=[2*inch, 4*inch])
-    cliente_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#ecf0f1')),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-        ('GRID', (0, 0), (-1, -1), 1, colors.grey)
-    ]))
+    cliente_table.setStyle(_INFO_TABLE_STYLE)
     elements.append(cliente_table)
     elements.append(Spacer(1, 0.3*inch))
     
     # Detalles de productos/servicios
     elements.append(Paragraph("DETALLE DE PRODUCTOS/SERVICIOS", styles['Heading2']))
     
-    detalles_data = [['Producto/Servicio', 'Cantidad', 'Precio Unit.', 'Subtotal']]
-    for detalle in factura.detalles.all():
-        detalles_data.append([
-            detalle.producto,
-            str(detalle.cantidad),
-            f"₲ {detalle.precio_unitario:,.0f}",
-            f"₲ {detalle.subtotal:,.0f}"
-        ])
+    detalles_filas = [
+        [producto, str(cantidad), formatear_monto(precio_unitario), formatear_monto(subtotal)]
+        for producto, cantidad, precio_unitario, subtotal in factura.detalles.values_list(
+            'producto', 'cantidad', 'precio_unitario', 'subtotal'
+        )
+    ]
     
-    detalles_table = Table(detalles_data, colWidths=[3*inch, 1*inch, 1.5*inch, 1.5*inch])
-    detalles_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#3498db')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 11),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    elements.append(detalles_table)
+    # Tablas chicas con su propio encabezado: el layout de ReportLab crece
+    # peor que linealmente con la cantidad de filas de una sola tabla
+    for inicio in range(0, max(len(detalles_filas), 1), _DETALLES_POR_TABLA):
+        detalles_table = Table(
+            [_DETALLES_ENCABEZADO] + detalles_filas[inicio:inicio + _DETALLES_POR_TABLA],
+            colWidths=[3*inch, 1*inch, 1.5*inch, 1.5*inch]
+        )
+        detalles_table.setStyle(_DETALLES_TABLE_STYLE)
+        elements.append(detalles_table)
     elements.append(Spacer(1, 0.3*inch))
     
     # Totales
     totales_data = [
-        ['Subtotal:', f"₲ {factura.subtotal:,.0f}"],
-        ['IVA (10%):', f"₲ {factura.iva:,.0f}"],
-        ['TOTAL:', f"₲ {factura.total:,.0f}"]
+        ['Subtotal:', formatear_monto(factura.subtotal)],
+        ['IVA (10%):', formatear_monto(factura.iva)],
+        ['TOTAL:', formatear_monto(factura.total)]
     ]
     
     totales_table = Table(totales_data, colWidths=[4.5*inch, 1.5*inch])
-    totales_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (0, 2), (-1, 2), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 2), (-1, 2), 14),
-        ('TEXTCOLOR', (0, 2), (-1, 2), colors.HexColor('#2c3e50')),
-        ('LINEABOVE', (0, 2), (-1, 2), 2, colors.black),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-    ]))
+    totales_table.setStyle(_TOTALES_TABLE_STYLE)
     elements.append(totales_table)
     
     # Observaciones
@@ -140,110 +249,100 @@ def generar_pdf_factura(factura):
     
     # Pie de página
     elements.append(Spacer(1, 0.5*inch))
-    footer_style = ParagraphStyle(
-        'Footer',
-        parent=styles['Normal'],
-        fontSize=8,
-        textColor=colors.grey,
-        alignment=TA_CENTER
-    )
+    footer_style = styles['Pie']
     elements.append(Paragraph("Sistema EasyInvoice - Facturación para Pequeños Negocios", footer_style))
     elements.append(Paragraph("San Lorenzo, Paraguay - 2025", footer_style))
     
+    # Se construye directo en output; getvalue() (BytesIO o HttpResponse) da los bytes a cachear
     doc.build(elements)
-    buffer.seek(0)
+    cache.set(cache_key, buffer.getvalue(), PDF_FACTURA_CACHE_TIMEOUT)
+    if output is None:
+        buffer.seek(0)
     return buffer
 
 
-def generar_reporte_ventas(facturas, fecha_desde=None, fecha_hasta=None):
+def generar_reporte_ventas(facturas, fecha_desde=None, fecha_hasta=None, output=None):
     """
-    Genera un reporte de ventas en PDF
+    Genera un reporte de ventas en PDF, escrito en output (p. ej. el
+    HttpResponse) o en un BytesIO nuevo
     """
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    # Las filas del detalle se traen una sola vez, como tuplas de solo lectura
+    facturas_listado = list(facturas.values_list(
+        'numero_factura', 'fecha_emision', 'cliente__nombre', 'estado', 'total'
+    )[:_REPORTE_MAX_FILAS])
+    
+    buffer = BytesIO() if output is None else output
+    doc = SimpleDocTemplate(buffer, **_DOC_OPCIONES)
     elements = []
-    styles = getSampleStyleSheet()
-    
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=16,
-        textColor=colors.HexColor('#2c3e50'),
-        spaceAfter=20,
-        alignment=TA_CENTER
-    )
+    styles = _get_estilos()
+    title_style = styles['TituloReporte']
     
     # Título
     elements.append(Paragraph("REPORTE DE VENTAS", title_style))
     
     # Período
     if fecha_desde and fecha_hasta:
-        periodo = f"Período: {fecha_desde.strftime('%d/%m/%Y')} - {fecha_hasta.strftime('%d/%m/%Y')}"
+        periodo = f"Período: {_fmt_fecha(fecha_desde)} - {_fmt_fecha(fecha_hasta)}"
     else:
         periodo = "Todas las ventas"
     elements.append(Paragraph(periodo, styles['Normal']))
     elements.append(Spacer(1, 0.3*inch))
     
     # Resumen
-    total_facturas = facturas.count()
-    total_monto = sum(f.total for f in facturas)
-    facturas_pagadas = facturas.filter(estado='PAGADA').count()
-    monto_pagado = sum(f.total for f in facturas.filter(estado='PAGADA'))
-    facturas_pendientes = facturas.filter(estado='PENDIENTE').count()
-    monto_pendiente = sum(f.total for f in facturas.filter(estado='PENDIENTE'))
+    # Los seis números del resumen en una sola consulta
+    cero = Value(Decimal('0'))
+    resumen = facturas.order_by().aggregate(
+        total_facturas=Count('id'),
+        total_monto=Coalesce(Sum('total'), cero),
+        facturas_pagadas=Count('id', filter=Q(estado='PAGADA')),
+        monto_pagado=Coalesce(Sum('total', filter=Q(estado='PAGADA')), cero),
+        facturas_pendientes=Count('id', filter=Q(estado='PENDIENTE')),
+        monto_pendiente=Coalesce(Sum('total', filter=Q(estado='PENDIENTE')), cero),
+    )
+    total_facturas = resumen['total_facturas']
+    total_monto = resumen['total_monto']
+    facturas_pagadas = resumen['facturas_pagadas']
+    monto_pagado = resumen['monto_pagado']
+    facturas_pendientes = resumen['facturas_pendientes']
+    monto_pendiente = resumen['monto_pendiente']
     
     resumen_data = [
         ['RESUMEN GENERAL', ''],
         ['Total de Facturas:', str(total_facturas)],
         ['Facturas Pagadas:', str(facturas_pagadas)],
         ['Facturas Pendientes:', str(facturas_pendientes)],
-        ['Monto Total:', f"₲ {total_monto:,.0f}"],
-        ['Monto Pagado:', f"₲ {monto_pagado:,.0f}"],
-        ['Monto Pendiente:', f"₲ {monto_pendiente:,.0f}"],
+        ['Monto Total:', formatear_monto(total_monto)],
+        ['Monto Pagado:', formatear_monto(monto_pagado)],
+        ['Monto Pendiente:', formatear_monto(monto_pendiente)],
     ]
     
     resumen_table = Table(resumen_data, colWidths=[3*inch, 3*inch])
-    resumen_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#3498db')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-        ('GRID', (0, 0), (-1, -1), 1, colors.grey)
-    ]))
+    resumen_table.setStyle(_RESUMEN_TABLE_STYLE)
     elements.append(resumen_table)
     elements.append(Spacer(1, 0.3*inch))
     
     # Detalle de facturas
     elements.append(Paragraph("DETALLE DE FACTURAS", styles['Heading2']))
     
-    detalle_data = [['Nº Factura', 'Fecha', 'Cliente', 'Estado', 'Total']]
-    for factura in facturas[:50]:  # Limitar a 50 facturas
+    detalle_data = [_REPORTE_ENCABEZADO]
+    for numero_factura, fecha_emision, cliente_nombre, estado, total in facturas_listado:
         detalle_data.append([
-            factura.numero_factura,
-            factura.fecha_emision.strftime('%d/%m/%Y'),
-            factura.cliente.nombre[:30],
-            factura.get_estado_display(),
-            f"₲ {factura.total:,.0f}"
+            numero_factura,
+            _fmt_fecha(fecha_emision),
+            cliente_nombre[:30],
+            _ESTADO_DISPLAY[estado],
+            formatear_monto(total)
         ])
     
     detalle_table = Table(detalle_data, colWidths=[1.2*inch, 1*inch, 2.5*inch, 1*inch, 1.3*inch])
-    detalle_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#3498db')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 8),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
+    detalle_table.setStyle(_REPORTE_TABLE_STYLE)
     elements.append(detalle_table)
     
-    if facturas.count() > 50:
+    if total_facturas > _REPORTE_MAX_FILAS:
         elements.append(Spacer(1, 0.2*inch))
-        elements.append(Paragraph(f"Mostrando las primeras 50 de {facturas.count()} facturas", styles['Italic']))
+        elements.append(Paragraph(f"Mostrando las primeras {_REPORTE_MAX_FILAS} de {total_facturas} facturas", styles['Italic']))
     
     doc.build(elements)
-    buffer.seek(0)
+    if output is None:
+        buffer.seek(0)
     return buffer
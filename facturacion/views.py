@@ -11,15 +11,23 @@ from django.utils import timezone
 from django.utils.http import url_has_allowed_host_and_scheme
 from django.utils.html import escape
 from django.core.exceptions import ValidationError
-from django.db import transaction
+from django.db import transaction, IntegrityError
 from django.contrib.auth import authenticate, login, logout
-from django.db.models import Q, Sum, Count
+from django.db.models import Q, Sum, Count, Value, FloatField
+from django.db.models.functions import Cast, Coalesce
+from django.core.cache import cache
 from django.core.paginator import Paginator
 from django.core.mail import EmailMessage
 from django.template.loader import render_to_string
 from datetime import date, timedelta
 from decimal import Decimal
-from .models import Cliente, Factura, DetalleFactura, TimbradoConfig, Producto
+import hashlib
+import time
+from .models import (
+    Cliente, Factura, DetalleFactura, TimbradoConfig, Producto,
+    DASHBOARD_CACHE_KEY, DASHBOARD_CACHE_TIMEOUT, REPORTES_VERSION_CACHE_KEY, REPORTES_CACHE_TIMEOUT,
+    PRODUCTO_PRECIO_CACHE_KEY, CHOICES_CACHE_TIMEOUT
+)
 from .forms import (
     ClienteForm, FacturaForm, DetalleFacturaFormSet,
     BusquedaFacturaForm, BusquedaClienteForm, FacturaEliminarForm, TimbradoForm, TimbradoConfigForm, ProductoForm
@@ -28,6 +36,18 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Columnas que muestran los listados; evita traer observaciones y dirección
+_FACTURA_LISTADO_CAMPOS = (
+    'numero_factura', 'fecha_emision', 'total', 'estado', 'cliente__nombre', 'cliente__ruc_ci'
+)
+_CLIENTE_LISTADO_CAMPOS = ('nombre', 'ruc_ci', 'email', 'telefono', 'activo')
+_REPORTE_LISTADO_CAMPOS = (
+    'numero_factura', 'fecha_emision', 'estado', 'subtotal', 'iva', 'total', 'cliente__nombre'
+)
+_REPORTE_POR_PAGINA = 50
+# Orden del reporte, igual en pantalla (clave de la paginación) y en el PDF
+_REPORTE_ORDEN = ('-fecha_emision', '-id')
+
 
 def enviar_factura_email(factura):
     """Envía la factura por correo electrónico al cliente"""
@@ -35,40 +55,11 @@ def enviar_factura_email(factura):
         if not factura.cliente.email:
             return False, 'El cliente no tiene email registrado'
         
-        detalles = factura.detalles.all()
-        
         asunto = f'Factura {factura.numero_factura} - Sistema de Facturación'
-        
-        mensaje = f"""
-Estimado/a {factura.cliente.nombre},
-
-Adjuntamos la factura {factura.numero_factura} correspondiente a su compra.
-
-DETALLE DE LA FACTURA:
-{'='*50}
-Número: {factura.numero_factura}
-Fecha: {factura.fecha_emision.strftime('%d/%m/%Y')}
-Estado: {factura.get_estado_display()}
-
-PRODUCTOS/SERVICIOS:
-{'-'*50}
-"""
-        
-        for detalle in detalles:
-            mensaje += f"{detalle.producto} - Cant: {detalle.cantidad} x ₲{detalle.precio_unitario:,.0f} = ₲{detalle.subtotal:,.0f}\n"
-        
-        mensaje += f"""
-{'-'*50}
-Subtotal: ₲{factura.subtotal:,.0f}
-IVA (10%): ₲{factura.iva:,.0f}
-TOTAL: ₲{factura.total:,.0f}
-{'='*50}
-
-Gracias por su preferencia.
-
-Saludos cordiales,
-Sistema de Facturación
-"""
+        mensaje = render_to_string('facturacion/email/factura.txt', {
+            'factura': factura,
+            'detalles': factura.detalles.values('producto', 'cantidad', 'precio_unitario', 'subtotal'),
+        })
         
         email = EmailMessage(
             asunto,
@@ -80,46 +71,19 @@ Sistema de Facturación
         return True, 'Factura enviada exitosamente'
         
     except Exception as e:
-        logger.error(f'Error enviando factura por email: {e}')
+        logger.error('Error enviando factura por email: %s', e)
         return False, f'Error al enviar email: {str(e)}'
 
 
 # ==================== AUTENTICACIÓN ====================
 
-def login_usuario_view(request):
-    """Vista de inicio de sesión para usuarios normales"""
-    if request.user.is_authenticated:
-        return redirect('facturacion:dashboard')
-    
-    if request.method == 'POST':
-        try:
-            username = request.POST.get('username', '').strip()
-            password = request.POST.get('password', '')
-            
-            if not username or not password:
-                messages.error(request, 'Usuario y contraseña son requeridos')
-                return render(request, 'facturacion/login_particles.html')
-            
-            user = authenticate(request, username=username, password=password)
-            
-            if user is not None:
-                login(request, user)
-                messages.success(request, f'¡Bienvenido {escape(user.username)}!')
-                next_url = request.GET.get('next')
-                if next_url and url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
-                    return redirect(next_url)
-                return redirect('facturacion:dashboard')
-            else:
-                messages.error(request, 'Usuario o contraseña incorrectos')
-        except Exception as e:
-            logger.error(f'Error en login usuario: {e}')
-            messages.error(request, 'Error interno del servidor')
-    
-    return render(request, 'facturacion/login_particles.html')
+# Intentos fallidos de login permitidos por IP antes de dejar de llamar a authenticate()
+_LOGIN_MAX_FALLOS = 5
+_LOGIN_BLOQUEO_SEGUNDOS = 60
 
 
-def login_admin_view(request):
-    """Vista de inicio de sesión exclusiva para administradores"""
+def _login_con_plantilla(request, template_name, es_admin):
+    """Procesa el login común a usuarios y administradores, limitando fallos por IP"""
     if request.user.is_authenticated:
         return redirect('facturacion:dashboard')
     
@@ -130,13 +94,20 @@ def login_admin_view(request):
             
             if not username or not password:
                 messages.error(request, 'Usuario y contraseña son requeridos')
-                return render(request, 'facturacion/login_admin_particles.html')
+                return render(request, template_name)
+            
+            # Cortar antes de authenticate(): el hash de la contraseña es lo costoso
+            fallos_key = f"facturacion:login_fallos:{request.META.get('REMOTE_ADDR', '')}"
+            if cache.get(fallos_key, 0) >= _LOGIN_MAX_FALLOS:
+                messages.error(request, 'Demasiados intentos fallidos. Intente nuevamente en un minuto')
+                return render(request, template_name)
             
             user = authenticate(request, username=username, password=password)
             
             if user is not None:
                 login(request, user)
-                if user.is_staff or user.is_superuser:
+                cache.delete(fallos_key)
+                if es_admin and (user.is_staff or user.is_superuser):
                     messages.success(request, f'¡Bienvenido Administrador {escape(user.username)}!')
                 else:
                     messages.success(request, f'¡Bienvenido {escape(user.username)}!')
@@ -145,12 +116,26 @@ def login_admin_view(request):
                     return redirect(next_url)
                 return redirect('facturacion:dashboard')
             else:
+                try:
+                    cache.incr(fallos_key)
+                except ValueError:
+                    cache.set(fallos_key, 1, _LOGIN_BLOQUEO_SEGUNDOS)
                 messages.error(request, 'Usuario o contraseña incorrectos')
         except Exception as e:
-            logger.error(f'Error en login admin: {e}')
+            logger.error('Error en login %s: %s', 'admin' if es_admin else 'usuario', e)
             messages.error(request, 'Error interno del servidor')
     
-    return render(request, 'facturacion/login_admin_particles.html')
+    return render(request, template_name)
+
+
+def login_usuario_view(request):
+    """Vista de inicio de sesión para usuarios normales"""
+    return _login_con_plantilla(request, 'facturacion/login_particles.html', es_admin=False)
+
+
+def login_admin_view(request):
+    """Vista de inicio de sesión exclusiva para administradores"""
+    return _login_con_plantilla(request, 'facturacion/login_admin_particles.html', es_admin=True)
 
 
 @login_required
@@ -163,47 +148,35 @@ def logout_view(request):
 
 # ==================== DASHBOARD ====================
 
-@login_required
-def dashboard(request):
-    """Vista principal con dashboard y estadísticas"""
-    # Estadísticas generales
-    total_facturas = Factura.objects.filter(activo=True).count()
+def _dashboard_context():
+    """Estadísticas del dashboard; son iguales para todos los usuarios"""
+    # Estadísticas generales: todos los conteos y montos en una sola consulta
+    hoy = timezone.now().date()
+    inicio_mes = hoy.replace(day=1)
+    cero = Value(Decimal('0'))
+    resumen = Factura.objects.filter(activo=True).aggregate(
+        total_facturas=Count('id'),
+        total_facturado=Coalesce(Sum('total', filter=Q(estado='PAGADA')), cero),
+        facturas_pendientes=Count('id', filter=Q(estado='PENDIENTE')),
+        monto_pendiente=Coalesce(Sum('total', filter=Q(estado='PENDIENTE')), cero),
+        facturacion_mes=Coalesce(
+            Sum('total', filter=Q(estado='PAGADA', fecha_emision__gte=inicio_mes)), cero
+        ),
+    )
     total_clientes = Cliente.objects.filter(activo=True).count()
     
-    # Total facturado (solo facturas pagadas)
-    total_facturado = Factura.objects.filter(
-        activo=True,
-        estado='PAGADA'
-    ).aggregate(total=Sum('total'))['total'] or Decimal('0')
-    
-    # Facturas pendientes
-    facturas_pendientes = Factura.objects.filter(
-        activo=True,
-        estado='PENDIENTE'
-    ).count()
-    
-    # Monto pendiente de cobro
-    monto_pendiente = Factura.objects.filter(
-        activo=True,
-        estado='PENDIENTE'
-    ).aggregate(total=Sum('total'))['total'] or Decimal('0')
-    
     # Últimas 5 facturas - optimizado
-    try:
-        ultimas_facturas = Factura.objects.filter(
-            activo=True
-        ).select_related('cliente').order_by('-fecha_emision', '-numero_factura')[:5]
-    except Exception as e:
-        logger.error(f'Error obteniendo últimas facturas: {e}')
-        ultimas_facturas = []
+    ultimas_facturas = Factura.objects.filter(
+        activo=True
+    ).select_related('cliente').only(
+        *_FACTURA_LISTADO_CAMPOS
+    ).order_by('-fecha_emision', '-numero_factura')[:5]
     
-    # Clientes con más facturas
+    # Clientes con más facturas: filtrar por facturas activas antes de anotar hace
+    # que el JOIN ya descarte a los clientes sin facturas, sin un HAVING posterior
     top_clientes = Cliente.objects.filter(
-        activo=True
-    ).annotate(
-        total_facturas=Count('facturas', filter=Q(facturas__activo=True)),
-        total_facturado=Sum('facturas__total', filter=Q(facturas__activo=True, facturas__estado='PAGADA'))
-    ).filter(total_facturas__gt=0).order_by('-total_facturado')[:5]
+        activo=True, facturas__activo=True
+    ).only('nombre').with_stats().order_by('-total_pagado')[:5]
     
     # Estadísticas por estado
     facturas_por_estado = Factura.objects.filter(
@@ -213,31 +186,19 @@ def dashboard(request):
         total=Sum('total')
     ).order_by('estado')
     
-    # Facturación del mes actual - con timezone aware
-    try:
-        hoy = timezone.now().date()
-        inicio_mes = hoy.replace(day=1)
-        facturacion_mes = Factura.objects.filter(
-            activo=True,
-            fecha_emision__gte=inicio_mes,
-            estado='PAGADA'
-        ).aggregate(total=Sum('total'))['total'] or Decimal('0')
-    except Exception as e:
-        logger.error(f'Error calculando facturación del mes: {e}')
-        facturacion_mes = Decimal('0')
-    
-    context = {
-        'total_facturas': total_facturas,
+    return {
+        **resumen,
         'total_clientes': total_clientes,
-        'total_facturado': total_facturado,
-        'facturas_pendientes': facturas_pendientes,
-        'monto_pendiente': monto_pendiente,
-        'ultimas_facturas': ultimas_facturas,
-        'top_clientes': top_clientes,
-        'facturas_por_estado': facturas_por_estado,
-        'facturacion_mes': facturacion_mes,
+        'ultimas_facturas': list(ultimas_facturas),
+        'top_clientes': list(top_clientes),
+        'facturas_por_estado': list(facturas_por_estado),
     }
-    
+
+
+@login_required
+def dashboard(request):
+    """Vista principal con dashboard y estadísticas"""
+    context = cache.get_or_set(DASHBOARD_CACHE_KEY, _dashboard_context, DASHBOARD_CACHE_TIMEOUT)
     return render(request, 'facturacion/dashboard.html', context)
 
 
@@ -246,7 +207,7 @@ def dashboard(request):
 @login_required
 def factura_lista(request):
     """Vista de listado de facturas con búsqueda y filtros"""
-    facturas = Factura.objects.filter(activo=True).select_related('cliente')
+    facturas = Factura.objects.filter(activo=True).select_related('cliente').only(*_FACTURA_LISTADO_CAMPOS)
     form = BusquedaFacturaForm(request.GET)
     
     if form.is_valid():
@@ -290,7 +251,7 @@ def factura_lista(request):
     context = {
         'page_obj': page_obj,
         'form': form,
-        'total_facturas': facturas.count()
+        'total_facturas': paginator.count
     }
     
     return render(request, 'facturacion/factura_lista.html', context)
@@ -299,12 +260,10 @@ def factura_lista(request):
 @login_required
 def factura_detalle(request, pk):
     """Vista de detalle de factura"""
-    factura = get_object_or_404(Factura, pk=pk)
-    detalles = factura.detalles.all()
+    factura = get_object_or_404(Factura.objects.with_related(), pk=pk)
     
     context = {
         'factura': factura,
-        'detalles': detalles
     }
     return render(request, 'facturacion/factura_detalle.html', context)
 
@@ -320,12 +279,9 @@ def factura_crear(request):
         messages.error(request, 'No se puede crear facturas: No hay timbrado configurado en el sistema')
         return redirect('facturacion:factura_lista')
     
-    if hoy < config_timbrado.fecha_inicio:
-        messages.error(request, f'No se puede crear facturas: El timbrado aún no está vigente (inicia el {config_timbrado.fecha_inicio})')
-        return redirect('facturacion:factura_lista')
-    
-    if hoy > config_timbrado.fecha_vencimiento:
-        messages.error(request, f'No se puede crear facturas: El timbrado está vencido (venció el {config_timbrado.fecha_vencimiento})')
+    vigente, motivo = config_timbrado.validar_vigencia(hoy)
+    if not vigente:
+        messages.error(request, f'No se puede crear facturas: {motivo}')
         return redirect('facturacion:factura_lista')
     
     if request.method == 'POST':
@@ -358,17 +314,15 @@ def factura_crear(request):
             else:
                 messages.error(request, 'Por favor corrija los errores en el formulario')
         except Exception as e:
-            logger.error(f'Error creando factura: {e}')
+            logger.error('Error creando factura: %s', e)
             messages.error(request, 'Error interno al crear la factura')
     else:
         form = FacturaForm(initial={'fecha_emision': timezone.now().date()}, user=request.user, es_creacion=True)
         formset = DetalleFacturaFormSet()
     
-    productos = Producto.objects.filter(activo=True).order_by('nombre')
     context = {
         'form': form,
         'formset': formset,
-        'productos': productos,
         'accion': 'Crear'
     }
     return render(request, 'facturacion/factura_form.html', context)
@@ -400,23 +354,21 @@ def factura_editar(request, pk):
                 else:
                     messages.error(request, 'Por favor corrija los errores en el formulario')
             except Exception as e:
-                logger.error(f'Error editando factura {pk}: {e}')
+                logger.error('Error editando factura %s: %s', pk, e)
                 messages.error(request, 'Error interno al actualizar la factura')
         else:
             form = FacturaForm(instance=factura, user=request.user, es_creacion=False)
             formset = DetalleFacturaFormSet(instance=factura)
         
-        productos = Producto.objects.filter(activo=True).order_by('nombre')
         context = {
             'form': form,
             'formset': formset,
             'factura': factura,
-            'productos': productos,
             'accion': 'Editar'
         }
         return render(request, 'facturacion/factura_form.html', context)
     except Exception as e:
-        logger.error(f'Error accediendo a factura {pk}: {e}')
+        logger.error('Error accediendo a factura %s: %s', pk, e)
         messages.error(request, 'Factura no encontrada')
         return redirect('facturacion:factura_lista')
 
@@ -434,37 +386,24 @@ def factura_anular(request, pk):
         if request.method == 'POST':
             form = FacturaEliminarForm(request.POST)
             
-            # Recuperar captcha de la sesión
             try:
-                if 'captcha_a' in request.session and 'captcha_b' in request.session:
-                    form.captcha_a = request.session['captcha_a']
-                    form.captcha_b = request.session['captcha_b']
-                    form.captcha_respuesta_correcta = form.captcha_a + form.captcha_b
-                else:
-                    messages.error(request, 'Sesión expirada. Intente nuevamente.')
-                    return redirect('facturacion:factura_anular', pk=pk)
-                
                 if form.is_valid():
                     with transaction.atomic():
                         factura.anular()
-                    request.session.pop('captcha_a', None)
-                    request.session.pop('captcha_b', None)
                     messages.success(request, f'Factura {escape(factura.numero_factura)} anulada exitosamente')
                     return redirect('facturacion:factura_lista')
                 else:
                     messages.error(request, 'Captcha incorrecto. Intente nuevamente.')
             except Exception as e:
-                logger.error(f'Error anulando factura {pk}: {e}')
+                logger.error('Error anulando factura %s: %s', pk, e)
                 messages.error(request, 'Error interno al anular la factura')
         else:
             form = FacturaEliminarForm()
-            request.session['captcha_a'] = form.captcha_a
-            request.session['captcha_b'] = form.captcha_b
         
         context = {'factura': factura, 'form': form}
         return render(request, 'facturacion/factura_confirmar_anular.html', context)
     except Exception as e:
-        logger.error(f'Error accediendo a factura para anular {pk}: {e}')
+        logger.error('Error accediendo a factura para anular %s: %s', pk, e)
         messages.error(request, 'Factura no encontrada')
         return redirect('facturacion:factura_lista')
 
@@ -491,14 +430,13 @@ def factura_pdf(request, pk):
     from .utils import generar_pdf_factura
     
     try:
-        factura = get_object_or_404(Factura, pk=pk)
-        pdf_buffer = generar_pdf_factura(factura)
-        
-        response = HttpResponse(pdf_buffer, content_type='application/pdf')
+        factura = get_object_or_404(Factura.objects.select_related('cliente'), pk=pk)
+        response = HttpResponse(content_type='application/pdf')
         response['Content-Disposition'] = f'attachment; filename="factura_{factura.numero_factura}.pdf"'
+        generar_pdf_factura(factura, response)
         return response
     except Exception as e:
-        logger.error(f'Error generando PDF de factura {pk}: {e}')
+        logger.error('Error generando PDF de factura %s: %s', pk, e)
         messages.error(request, 'Error al generar el PDF')
         return redirect('facturacion:factura_detalle', pk=pk)
 
@@ -508,10 +446,7 @@ def factura_pdf(request, pk):
 @login_required
 def cliente_lista(request):
     """Vista de listado de clientes"""
-    clientes = Cliente.objects.filter(activo=True).annotate(
-        total_facturas=Count('facturas', filter=Q(facturas__activo=True)),
-        total_facturado=Sum('facturas__total', filter=Q(facturas__activo=True, facturas__estado='PAGADA'))
-    )
+    clientes = Cliente.objects.filter(activo=True).only(*_CLIENTE_LISTADO_CAMPOS).with_stats()
     
     form = BusquedaClienteForm(request.GET)
     
@@ -536,7 +471,7 @@ def cliente_lista(request):
     context = {
         'page_obj': page_obj,
         'form': form,
-        'total_clientes': clientes.count()
+        'total_clientes': paginator.count
     }
     return render(request, 'facturacion/cliente_lista.html', context)
 
@@ -567,8 +502,12 @@ def cliente_crear(request):
                 return redirect('facturacion:cliente_detalle', pk=cliente.pk)
             else:
                 messages.error(request, 'Por favor corrija los errores en el formulario')
+        except IntegrityError:
+            # Otro request registró el mismo RUC/CI entre la validación y el INSERT
+            form.add_error('ruc_ci', 'Ya existe un cliente con este RUC/CI')
+            messages.error(request, 'Por favor corrija los errores en el formulario')
         except Exception as e:
-            logger.error(f'Error creando cliente: {e}')
+            logger.error('Error creando cliente: %s', e)
             messages.error(request, 'Error interno al crear el cliente')
     else:
         form = ClienteForm()
@@ -593,8 +532,11 @@ def cliente_editar(request, pk):
                     return redirect('facturacion:cliente_detalle', pk=cliente.pk)
                 else:
                     messages.error(request, 'Por favor corrija los errores en el formulario')
+            except IntegrityError:
+                form.add_error('ruc_ci', 'Ya existe un cliente con este RUC/CI')
+                messages.error(request, 'Por favor corrija los errores en el formulario')
             except Exception as e:
-                logger.error(f'Error editando cliente {pk}: {e}')
+                logger.error('Error editando cliente %s: %s', pk, e)
                 messages.error(request, 'Error interno al actualizar el cliente')
         else:
             form = ClienteForm(instance=cliente)
@@ -606,7 +548,7 @@ def cliente_editar(request, pk):
         }
         return render(request, 'facturacion/cliente_form.html', context)
     except Exception as e:
-        logger.error(f'Error accediendo a cliente {pk}: {e}')
+        logger.error('Error accediendo a cliente %s: %s', pk, e)
         messages.error(request, 'Cliente no encontrado')
         return redirect('facturacion:cliente_lista')
 
@@ -615,27 +557,26 @@ def cliente_editar(request, pk):
 def cliente_eliminar(request, pk):
     """Vista para eliminar cliente (soft delete)"""
     cliente = get_object_or_404(Cliente, pk=pk)
-    
-    # Verificar si tiene facturas asociadas
-    facturas_activas = cliente.facturas.filter(activo=True).count()
+    facturas = cliente.facturas.filter(activo=True)
     
     if request.method == 'POST':
-        if facturas_activas > 0:
+        # Para bloquear el borrado alcanza con saber si existe alguna factura
+        if facturas.exists():
             messages.error(
                 request,
-                f'No se puede eliminar el cliente "{cliente.nombre}" porque tiene {facturas_activas} factura(s) asociada(s)'
+                f'No se puede eliminar el cliente "{cliente.nombre}" porque tiene factura(s) asociada(s)'
             )
             return redirect('facturacion:cliente_lista')
         
         nombre = cliente.nombre
         cliente.activo = False
-        cliente.save()
+        cliente.save(update_fields=['activo', 'fecha_actualizacion'])
         messages.success(request, f'Cliente "{nombre}" eliminado exitosamente')
         return redirect('facturacion:cliente_lista')
     
     context = {
         'cliente': cliente,
-        'facturas_activas': facturas_activas
+        'facturas_activas': facturas.count()
     }
     return render(request, 'facturacion/cliente_confirmar_eliminar.html', context)
 
@@ -685,7 +626,7 @@ def producto_eliminar(request, pk):
     producto = get_object_or_404(Producto, pk=pk)
     if request.method == 'POST':
         producto.activo = False
-        producto.save()
+        producto.save(update_fields=['activo'])
         messages.success(request, f'Producto "{producto.nombre}" eliminado')
         return redirect('facturacion:producto_lista')
     return render(request, 'facturacion/producto_confirmar_eliminar.html', {'producto': producto})
@@ -724,7 +665,7 @@ def factura_añadir_timbrado(request, pk):
                 else:
                     messages.error(request, 'Corrija los errores en el formulario')
             except Exception as e:
-                logger.error(f'Error añadiendo timbrado a factura {pk}: {e}')
+                logger.error('Error añadiendo timbrado a factura %s: %s', pk, e)
                 messages.error(request, 'Error interno al añadir timbrado')
         else:
             form = TimbradoForm(instance=factura)
@@ -732,7 +673,7 @@ def factura_añadir_timbrado(request, pk):
         context = {'factura': factura, 'form': form}
         return render(request, 'facturacion/factura_timbrado_form.html', context)
     except Exception as e:
-        logger.error(f'Error accediendo a factura para timbrado {pk}: {e}')
+        logger.error('Error accediendo a factura para timbrado %s: %s', pk, e)
         messages.error(request, 'Factura no encontrada')
         return redirect('facturacion:factura_lista')
 
@@ -758,56 +699,99 @@ def timbrado_eliminar(request, pk):
         context = {'config': config}
         return render(request, 'facturacion/timbrado_confirmar_eliminar.html', context)
     except Exception as e:
-        logger.error(f'Error eliminando configuración de timbrado: {e}')
+        logger.error('Error eliminando configuración de timbrado: %s', e)
         messages.error(request, 'Error al eliminar la configuración')
         return redirect('facturacion:timbrado_configurar')
 
 
+def _filtros_reporte(params):
+    """Interpreta fecha_desde, fecha_hasta y estado del querystring en un solo Q"""
+    filtro = Q(activo=True)
+    fechas = []
+    for nombre, lookup in (('fecha_desde', 'fecha_emision__gte'), ('fecha_hasta', 'fecha_emision__lte')):
+        try:
+            fecha = date.fromisoformat(params.get(nombre) or '')
+        except ValueError:
+            fecha = None
+        else:
+            filtro &= Q(**{lookup: fecha})
+        fechas.append(fecha)
+    estado = params.get('estado')
+    if estado:
+        filtro &= Q(estado=estado)
+    return filtro, fechas[0], fechas[1], estado
+
+
+def _reporte_cache_key(fecha_desde, fecha_hasta, estado):
+    """Prefijo de cache del reporte; cambia con cada modificación de facturas o clientes"""
+    version = cache.get_or_set(REPORTES_VERSION_CACHE_KEY, time.time_ns, None)
+    filtros = hashlib.md5(f'{fecha_desde}|{fecha_hasta}|{estado}'.encode()).hexdigest()
+    return f'facturacion:reporte:{version}:{filtros}'
+
+
 @login_required
 def reportes_ventas(request):
     """Vista de reportes de ventas con filtros"""
-    facturas = Factura.objects.filter(activo=True).select_related('cliente')
-    
-    # Filtros
-    fecha_desde = request.GET.get('fecha_desde')
-    fecha_hasta = request.GET.get('fecha_hasta')
-    estado = request.GET.get('estado')
-    
-    if fecha_desde:
-        try:
-            fecha_desde = date.fromisoformat(fecha_desde)
-            facturas = facturas.filter(fecha_emision__gte=fecha_desde)
-        except ValueError:
-            fecha_desde = None
+    filtro, fecha_desde, fecha_hasta, estado = _filtros_reporte(request.GET)
+    facturas = Factura.objects.filter(filtro)
+    
+    # Estadísticas: conteos y montos por estado en una sola consulta, cacheada por
+    # filtros; cualquier cambio en facturas cambia la versión y descarta las anteriores
+    cero = Value(Decimal('0'))
+    reporte_cache_key = _reporte_cache_key(fecha_desde, fecha_hasta, estado)
+    estadisticas = cache.get_or_set(
+        reporte_cache_key,
+        lambda: facturas.order_by().aggregate(
+            total_facturas=Count('id'),
+            total_monto=Coalesce(Sum('total'), cero),
+            facturas_pagadas=Count('id', filter=Q(estado='PAGADA')),
+            monto_pagado=Coalesce(Sum('total', filter=Q(estado='PAGADA')), cero),
+            facturas_pendientes=Count('id', filter=Q(estado='PENDIENTE')),
+            monto_pendiente=Coalesce(Sum('total', filter=Q(estado='PENDIENTE')), cero),
+            facturas_anuladas=Count('id', filter=Q(estado='ANULADA')),
+        ),
+        REPORTES_CACHE_TIMEOUT
+    )
     
-    if fecha_hasta:
+    # Paginación por clave (fecha_emision, id): cada página es un rango del índice,
+    # sin OFFSET que recorra las filas anteriores
+    pagina = facturas.order_by(*_REPORTE_ORDEN).select_related('cliente').only(
+        *_REPORTE_LISTADO_CAMPOS
+    )
+    despues = request.GET.get('after', '')
+    if despues:
+        fecha_clave, _, id_clave = despues.partition('_')
         try:
-            fecha_hasta = date.fromisoformat(fecha_hasta)
-            facturas = facturas.filter(fecha_emision__lte=fecha_hasta)
+            fecha_clave = date.fromisoformat(fecha_clave)
+            id_clave = int(id_clave)
+            pagina = pagina.filter(
+                Q(fecha_emision__lt=fecha_clave) | Q(fecha_emision=fecha_clave, id__lt=id_clave)
+            )
         except ValueError:
-            fecha_hasta = None
-    
-    if estado:
-        facturas = facturas.filter(estado=estado)
-    
-    # Estadísticas
-    total_facturas = facturas.count()
-    total_monto = facturas.aggregate(total=Sum('total'))['total'] or Decimal('0')
-    facturas_pagadas = facturas.filter(estado='PAGADA').count()
-    monto_pagado = facturas.filter(estado='PAGADA').aggregate(total=Sum('total'))['total'] or Decimal('0')
-    facturas_pendientes = facturas.filter(estado='PENDIENTE').count()
-    monto_pendiente = facturas.filter(estado='PENDIENTE').aggregate(total=Sum('total'))['total'] or Decimal('0')
-    facturas_anuladas = facturas.filter(estado='ANULADA').count()
+            despues = ''
+    
+    facturas_pagina = list(pagina[:_REPORTE_POR_PAGINA + 1])
+    siguiente_url = None
+    if len(facturas_pagina) > _REPORTE_POR_PAGINA:
+        facturas_pagina = facturas_pagina[:_REPORTE_POR_PAGINA]
+        ultima = facturas_pagina[-1]
+        parametros = request.GET.copy()
+        parametros['after'] = f'{ultima.fecha_emision.isoformat()}_{ultima.pk}'
+        siguiente_url = f'?{parametros.urlencode()}'
+    primera_url = None
+    if despues:
+        parametros = request.GET.copy()
+        del parametros['after']
+        primera_url = f'?{parametros.urlencode()}'
     
     context = {
-        'facturas': facturas[:50],
-        'total_facturas': total_facturas,
-        'total_monto': total_monto,
-        'facturas_pagadas': facturas_pagadas,
-        'monto_pagado': monto_pagado,
-        'facturas_pendientes': facturas_pendientes,
-        'monto_pendiente': monto_pendiente,
-        'facturas_anuladas': facturas_anuladas,
+        **estadisticas,
+        'facturas': facturas_pagina,
+        'siguiente_url': siguiente_url,
+        'primera_url': primera_url,
+        # La tabla se cachea como fragmento por versión, filtros y página
+        'reporte_cache_key': reporte_cache_key,
+        'despues': despues,
         'fecha_desde': fecha_desde,
         'fecha_hasta': fecha_hasta,
         'estado': estado,
@@ -822,36 +806,24 @@ def reportes_ventas_pdf(request):
     from .utils import generar_reporte_ventas
     
     try:
-        facturas = Factura.objects.filter(activo=True).select_related('cliente')
-        
-        fecha_desde = request.GET.get('fecha_desde')
-        fecha_hasta = request.GET.get('fecha_hasta')
-        estado = request.GET.get('estado')
+        filtro, fecha_desde, fecha_hasta, estado = _filtros_reporte(request.GET)
         
-        if fecha_desde:
-            try:
-                fecha_desde = date.fromisoformat(fecha_desde)
-                facturas = facturas.filter(fecha_emision__gte=fecha_desde)
-            except ValueError:
-                fecha_desde = None
-        
-        if fecha_hasta:
-            try:
-                fecha_hasta = date.fromisoformat(fecha_hasta)
-                facturas = facturas.filter(fecha_emision__lte=fecha_hasta)
-            except ValueError:
-                fecha_hasta = None
-        
-        if estado:
-            facturas = facturas.filter(estado=estado)
-        
-        pdf_buffer = generar_reporte_ventas(facturas, fecha_desde, fecha_hasta)
-        
-        response = HttpResponse(pdf_buffer, content_type='application/pdf')
+        # El mismo reporte se descarga varias veces sin volver a generarlo
+        # mientras no cambien las facturas
+        cache_key = _reporte_cache_key(fecha_desde, fecha_hasta, estado) + ':pdf'
+        pdf = cache.get(cache_key)
+        response = HttpResponse(content_type='application/pdf')
         response['Content-Disposition'] = 'attachment; filename="reporte_ventas.pdf"'
+        if pdf is None:
+            # Se construye directo en la respuesta y se cachean sus bytes
+            facturas = Factura.objects.filter(filtro).order_by(*_REPORTE_ORDEN)
+            generar_reporte_ventas(facturas, fecha_desde, fecha_hasta, response)
+            cache.set(cache_key, response.getvalue(), REPORTES_CACHE_TIMEOUT)
+        else:
+            response.write(pdf)
         return response
     except Exception as e:
-        logger.error(f'Error generando reporte de ventas PDF: {e}')
+        logger.error('Error generando reporte de ventas PDF: %s', e)
         messages.error(request, 'Error al generar el reporte')
         return redirect('facturacion:reportes_ventas')
 
@@ -862,16 +834,19 @@ def reportes_ventas_pdf(request):
 def api_producto_precio(request, pk):
     """API endpoint para obtener precio de producto"""
     from django.http import JsonResponse
-    try:
-        producto = get_object_or_404(Producto, pk=pk, activo=True)
-        return JsonResponse({
-            'id': producto.id,
-            'nombre': producto.nombre,
-            'precio': float(producto.precio)
-        })
-    except Exception as e:
-        logger.error(f'Error obteniendo precio de producto {pk}: {e}')
+    # Se consulta en cada línea agregada al formulario; se invalida al guardar el producto.
+    # SQLite devuelve el precio como REAL, listo para el JSON sin pasar por Decimal
+    producto = cache.get_or_set(
+        PRODUCTO_PRECIO_CACHE_KEY % pk,
+        lambda: Producto.objects.filter(pk=pk, activo=True).values_list(
+            'id', 'nombre', Cast('precio', FloatField())
+        ).first(),
+        CHOICES_CACHE_TIMEOUT
+    )
+    if producto is None:
         return JsonResponse({'error': 'Producto no encontrado'}, status=404)
+    id_producto, nombre, precio = producto
+    return JsonResponse({'id': id_producto, 'nombre': nombre, 'precio': precio})
 
 
 @login_required
@@ -896,10 +871,9 @@ def timbrado_configurar(request):
             if form.is_valid():
                 try:
                     with transaction.atomic():
-                        # Desactivar configuración anterior si existe
-                        if config_activa:
-                            config_activa.activo = False
-                            config_activa.save()
+                        # Desactivar la configuración anterior con un UPDATE directo;
+                        # el post_save de la nueva invalida el cache de timbrado activo
+                        TimbradoConfig.objects.filter(activo=True).update(activo=False)
                         
                         # Crear nueva configuración
                         nueva_config = form.save(commit=False)
@@ -909,8 +883,12 @@ def timbrado_configurar(request):
                         
                     messages.success(request, 'Configuración de timbrado guardada exitosamente')
                     return redirect('facturacion:timbrado_configurar')
+                except IntegrityError:
+                    # Otro usuario activó una configuración al mismo tiempo
+                    logger.warning('Conflicto de timbrado activo al guardar configuración')
+                    messages.error(request, 'Ya existe una configuración de timbrado activa. Recargue la página e intente de nuevo.')
                 except Exception as e:
-                    logger.error(f'Error guardando configuración de timbrado: {e}')
+                    logger.error('Error guardando configuración de timbrado: %s', e)
                     messages.error(request, 'Error al guardar la configuración')
             else:
                 messages.error(request, 'Corrija los errores en el formulario')
@@ -928,6 +906,6 @@ def timbrado_configurar(request):
         }
         return render(request, 'facturacion/timbrado_config_form.html', context)
     except Exception as e:
-        logger.error(f'Error en timbrado_configurar: {e}')
+        logger.error('Error en timbrado_configurar: %s', e)
         messages.error(request, 'Error interno del servidor')
         return redirect('facturacion:dashboard')
\ No newline at end of file
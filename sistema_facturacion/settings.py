@@ -72,9 +72,34 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Segundos de espera ante un escritor concurrente antes de "database is locked";
+        # el modo WAL se activa en facturacion/signals.py
+        'OPTIONS': {'timeout': 20},
+        # Reusar la conexión entre requests evita reconectar y repetir los PRAGMA
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Cache
+# Solo se cachean datos de poca escritura (opciones de clientes y productos),
+# invalidados por señales en facturacion/signals.py. Con varios procesos se
+# debe usar un cache compartido (REDIS_URL, requiere el paquete redis) para
+# que la invalidación llegue a todos los workers.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -133,6 +158,10 @@ NUMERO_FACTURA_INICIO = 1000  # Número inicial de factura
 TIMBRADO_REGEX = r'^\d{8,15}$'
 TIMBRADO_MAX_DIAS_VIGENCIA = 730  # 2 años
 
+# ===== CONFIGURACIÓN DE PDF =====
+# Comprimir las páginas achica la descarga a cambio de algo de CPU al generar
+PDF_PAGE_COMPRESSION = os.environ.get('PDF_PAGE_COMPRESSION', '1') == '1'
+
 # ===== CONFIGURACIÓN DE EMAIL =====
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'